@@ -0,0 +1,93 @@
+"""Generate synthetic notebook repositories for benchmarking nbpages.
+"""
+
+import base64
+import os
+import random
+
+import nbformat
+from nbformat.v4.nbbase import new_notebook, new_markdown_cell, new_code_cell, new_output
+
+from nbpages.nbsetup import index_md_tpl, notebook_header_tpl, notebook_tpl
+
+CONFIG = """[nbpages]
+github_repo_url = https://github.com/nbpages-bench/corpus.git
+github_user_name = nbpages-bench
+github_repo_name = corpus
+github_pages_url = https://nbpages-bench.github.io/corpus
+templates_dir = templates
+src_dir = notebooks
+dst_dir = docs
+figures_subdir = figures
+data_subdir = data
+"""
+
+MODULES = ["numpy as np", "pandas as pd", "matplotlib.pyplot as plt", "scipy.integrate", "sympy", "os", "json"]
+WORDS = "the model of a reactor with heat and mass transfer is solved for steady state and dynamic response".split()
+
+
+def make_notebook(rng, title, cells, tags, figures, data, output_kb):
+    """Return a notebook with a title, subsection headers, figure and data references, tags and outputs."""
+    nb = new_notebook(cells=[new_markdown_cell(f"# {title}")])
+    nb.metadata["kernelspec"] = {"display_name": "Python 3", "language": "python", "name": "python3"}
+    for k in range(1, cells):
+        if k % 2:
+            source = f"## Subsection {k}\n\n" if k % 10 == 1 else ""
+            source += " ".join(rng.choice(WORDS) for _ in range(60)) + "\n"
+            if figures and rng.random() < 0.3:
+                figure = rng.choice(figures)
+                source += f"\n![{figure}](figures/{figure})\n"
+            if rng.random() < 0.2:
+                source += f"\nSee [reference {k}](https://example.com/{k}).\n"
+            cell = new_markdown_cell(source)
+        else:
+            source = "\n".join(f"import {rng.choice(MODULES)}" for _ in range(rng.randint(0, 2)))
+            if data and rng.random() < 0.2:
+                source += f"\ndf = pd.read_csv('data/{rng.choice(data)}')"
+            source += f"\nx = [{', '.join(str(rng.random()) for _ in range(20))}]\nprint(sum(x))"
+            outputs = [new_output("stream", name="stdout", text=f"{rng.random()}\n")]
+            if output_kb:
+                png = base64.b64encode(rng.randbytes(output_kb * 1024)).decode()
+                outputs.append(new_output("display_data", data={"image/png": png, "text/plain": "<Figure>"}))
+            cell = new_code_cell(source, outputs=outputs, execution_count=k)
+        if tags and rng.random() < 0.2:
+            cell.metadata["tags"] = rng.sample(tags, rng.randint(1, min(3, len(tags))))
+        nb.cells.append(cell)
+    return nb
+
+
+def make_corpus(path, notebooks=20, cells=20, sections=5, tags=20, figures=10, data=5, output_kb=0, seed=0):
+    """Create a notebook repository at path with the layout produced by nbpages --setup.
+
+    Notebooks are named following NB_FILENAME, with a chapter notebook followed by sections-1 section notebooks
+    in each chapter. Tags include hierarchical tags of the form topic::subtopic. Figure and data files are
+    created in the notebooks directory and referenced from random cells. Each code cell has a stdout output
+    and, if output_kb is set, an embedded image of output_kb kilobytes.
+    """
+    rng = random.Random(seed)
+    for subdir in ["templates", "notebooks/figures", "notebooks/data", "docs/figures", "docs/data", ".git"]:
+        os.makedirs(os.path.join(path, subdir), exist_ok=True)
+    with open(os.path.join(path, "nbpages.cfg"), "w") as f:
+        f.write(CONFIG)
+    for filename, content in [("index.md.tpl", index_md_tpl), ("notebook_header.tpl", notebook_header_tpl),
+                              ("notebook.tpl", notebook_tpl)]:
+        with open(os.path.join(path, "templates", filename), "w") as f:
+            f.write(content)
+
+    figure_files = [f"figure_{k:04d}.png" for k in range(figures)]
+    for figure in figure_files:
+        with open(os.path.join(path, "notebooks", "figures", figure), "wb") as f:
+            f.write(rng.randbytes(2048))
+    data_files = [f"data_{k:04d}.csv" for k in range(data)]
+    for datafile in data_files:
+        with open(os.path.join(path, "notebooks", "data", datafile), "w") as f:
+            f.write("x,y\n" + "".join(f"{k},{rng.random()}\n" for k in range(100)))
+    tag_names = [f"topic-{k // 4}::subtopic-{k % 4}" if k % 2 else f"tag-{k}" for k in range(tags)]
+
+    for k in range(notebooks):
+        chapter, section = divmod(k, sections)
+        title = f"Chapter {chapter + 1}" if section == 0 else f"Section {chapter + 1}.{section}"
+        filename = f"{chapter + 1:02d}.{section:02d}-{title.replace(' ', '-').replace('.', '-')}.ipynb"
+        nb = make_notebook(rng, title, cells, tag_names, figure_files, data_files, output_kb)
+        nbformat.write(nb, os.path.join(path, "notebooks", filename))
+    return path
@@ -0,0 +1,104 @@
+"""Time the stages of nbpages --publish on a synthetic notebook repository.
+
+    python -m benchmarks.run --notebooks 100 --cells 40 --output_kb 50 --json results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+from nbpages import NbCollection
+from nbpages.nbcollection import PUBLISH_STAGES
+from nbpages.nbtiming import Timings
+
+from .corpus import make_corpus
+
+
+def run_stages(jobs=1, memory=False):
+    """Run the publish stages in the current directory and return a list of timing records.
+
+    The stages are those run by nbpages --publish, timed by the collection's Timings. Each record has the stage
+    name, wall and cpu time in seconds, notebooks per second, and the peak resident set size of the process at the
+    end of the stage. If memory is set, the peak python memory allocated during each stage is traced, at some cost
+    in speed.
+    """
+    timings = Timings()
+    peaks = {}
+
+    @contextlib.contextmanager
+    def trace(stage):
+        if memory:
+            tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        if memory:
+            peaks[stage] = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+
+    with trace("create"), timings.stage("create"):
+        notebooks = NbCollection(force=True, jobs=jobs, timings=timings)
+    for stage in PUBLISH_STAGES:
+        with trace(stage):
+            notebooks.run_stages((stage,))
+    results = []
+    for s in timings.stages:
+        record = {"stage": s["stage"], "seconds": round(s["wall"], 4), "cpu_seconds": round(s["cpu"], 4),
+                  "notebooks_per_second": round(len(notebooks.notebooks) / s["wall"], 1) if s["wall"] else None,
+                  "maxrss_mb": None if s["maxrss_mb"] is None else round(s["maxrss_mb"], 1)}
+        if memory:
+            record["peak_mb"] = peaks[s["stage"]]
+        results.append(record)
+    return results
+
+
+def print_table(results):
+    """Print timing records as a table."""
+    columns = list(results[0].keys())
+    widths = [max(len(c), *(len(str(r[c])) for r in results)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+    print(f"total {sum(r['seconds'] for r in results):.3f} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the nbpages publish stages on a synthetic repository")
+    parser.add_argument("--dir", help="create the repository in this directory instead of a temporary one")
+    parser.add_argument("--notebooks", type=int, default=20)
+    parser.add_argument("--cells", type=int, default=20, help="cells per notebook")
+    parser.add_argument("--sections", type=int, default=5, help="notebooks per chapter")
+    parser.add_argument("--tags", type=int, default=20, help="number of distinct tags")
+    parser.add_argument("--figures", type=int, default=10, help="number of figure files")
+    parser.add_argument("--data", type=int, default=5, help="number of data files")
+    parser.add_argument("--output_kb", type=int, default=0, help="size of an embedded image output per code cell")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--memory", help="trace peak python memory of each stage", action="store_true")
+    parser.add_argument("--json", help="write results to a json file for comparison across versions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.dir or tmp)
+        make_corpus(path, notebooks=args.notebooks, cells=args.cells, sections=args.sections, tags=args.tags,
+                    figures=args.figures, data=args.data, output_kb=args.output_kb, seed=args.seed)
+        cwd = os.getcwd()
+        os.chdir(path)
+        try:
+            results = run_stages(jobs=args.jobs, memory=args.memory)
+        finally:
+            os.chdir(cwd)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parameters": vars(args), "results": results}, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
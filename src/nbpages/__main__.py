@@ -1,3 +1,4 @@
+import json
 import os
 import re
 import sys
@@ -5,8 +6,18 @@ import argparse
 import configparser
 
 from .nbsetup import nbsetup, make_dir_if_needed
+from .nblogging import setup_logging
 
-# parse command line arguments first
+
+def shard(value):
+    """Return (index, count) for a shard given as I/N, with shards numbered from 1 to N."""
+    m = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError(f"shard must be given as I/N with 1 <= I <= N, not '{value}'")
+    return int(m.group(1)), int(m.group(2))
+
+
+# command line arguments, parsed in main()
 parser = argparse.ArgumentParser()
 
 # commands that don't write to the destination directory
@@ -14,71 +25,147 @@ parser.add_argument("--setup", help="create templates directory", action="store_
 parser.add_argument("--lint", help="report notebook lint", action="store_true")
 parser.add_argument("--metadata", help="display notebook metadata", action="store_true")
 parser.add_argument("--tags", help="display notebook tags", action="store_true")
-parser.add_argument("--get_cells", help="extract cells with specified tags", nargs="+")
+parser.add_argument("--find", help="show the notebook sections best matching words, using a full text index kept in "
+                    ".nbpages_cache. Words ending in * match by prefix")
+parser.add_argument("--query_tags", "--query-tags", help="show links to cells matching a tag query such as "
+                    "'author::FRB AND NOT exercise', or with --count the number of cells with each tag queried")
+parser.add_argument("--get_cells", help="extract cells with specified tags, printing a notebook for a single tag or "
+                    "writing <tag>.ipynb for each of several tags", nargs="+")
+parser.add_argument("--cells_dir", help="with --get_cells, write <tag>.ipynb for each tag to this directory")
 parser.add_argument("--search", help="show notebooks containing a regular expression", nargs=1)
+parser.add_argument("--search_outputs", help="with --search, also search text outputs of code cells", action="store_true")
+parser.add_argument("--count", help="with --search, count all matches in each notebook", action="store_true")
+parser.add_argument("--json", help="with --search, --find or --query_tags, print json records", action="store_true")
+parser.add_argument("--cache", help="cache parsed notebooks in .nbpages_cache", action="store_true")
 
 # commands that do write to the destination directory
 parser.add_argument("--publish", help="publish notebooks to the distination directory for github pages", action="store_true")
 parser.add_argument("--remove_cells", help="remove tagged cells", nargs="+")
 parser.add_argument("--remove_code", help="remove hidden and solution code from code cells", action="store_true")
+parser.add_argument("--search_json", help="write a json full text search index to search_index.json for the pages site",
+                    action="store_true")
+parser.add_argument("--extract_images", help="write output images to figures/_outputs and link them from the html pages",
+                    action="store_true")
+parser.add_argument("--execute", help="execute notebooks before publishing, reusing cached outputs of unchanged notebooks",
+                    action="store_true")
+parser.add_argument("--timeout", help="seconds allowed for executing each notebook (default 600)", type=int)
+parser.add_argument("--compress", help="write gzip, and brotli if installed, compressed copies of the published files",
+                    action="store_true")
+parser.add_argument("--variants", help="publish the variants defined in nbpages.cfg, or the named variants, each to its "
+                    "own destination directory", nargs="*", metavar="NAME")
+parser.add_argument("--shard", help="publish shard I of N of the notebooks, writing a partial index for --merge",
+                    type=shard, metavar="I/N")
+parser.add_argument("--merge", help="merge the partial indexes of a sharded publish into the index pages and manifest",
+                    action="store_true")
+parser.add_argument("--force", help="rewrite all published notebooks ignoring the build manifest", action="store_true")
+parser.add_argument("--jobs", help="number of worker processes used to write notebooks", type=int, default=1)
+parser.add_argument("--timings", help="print time and memory used by each stage, and write a json report to an optional file",
+                    nargs="?", const=True)
+parser.add_argument("--watch", help="publish, then republish the outputs affected by each change to the notebooks, "
+                    "data, figures or templates", action="store_true")
+parser.add_argument("--profile", help="write cProfile statistics for a stage to nbpages_<stage>.prof")
 
-# parse command line arguments
-args = parser.parse_args()
+# logging of progress messages to stderr
+parser.add_argument("-v", "--verbose", help="also report configuration, unchanged files and stage durations",
+                    action="count", default=0)
+parser.add_argument("-q", "--quiet", help="report warnings only", action="store_true")
+parser.add_argument("--log_json", help="write all log events as json lines to a file, or to stderr if '-'")
 
-# print help if no arguments
-if len(sys.argv) == 1:
-    parser.print_help()
-    sys.exit(0)
 
-# verify nbpages is run in the top level of a github repository
-if not os.path.exists('.git'):
-    print("nbpages must be run in the top level directory of a github notebook respository")
-    sys.exit(1)
+def main():
 
-# setup must be run to create configuration file before importing NbCollection
-if args.setup:
-    nbsetup()
-    sys.exit(0)
+    # parse command line arguments
+    args = parser.parse_args()
 
-from .nbcollection import NbCollection
+    # print help if no arguments
+    if len(sys.argv) == 1:
+        parser.print_help()
+        return 0
 
-def main():
+    # verify nbpages is run in the top level of a github repository
+    if not os.path.exists('.git'):
+        print("nbpages must be run in the top level directory of a github notebook respository")
+        return 1
+
+    # setup must be run to create configuration file before importing NbCollection
+    if args.setup:
+        return nbsetup()
+
+    setup_logging(verbosity=-1 if args.quiet else args.verbose, json_path=args.log_json)
 
-    notebooks = NbCollection()
+    from .nbcollection import NbCollection
+    from .nbtiming import Timings
+
+    timings = Timings(profile=args.profile)
+    options = dict(jobs=args.jobs, cache=args.cache, timings=timings, search_json=args.search_json,
+                   extract_images=args.extract_images, compress=args.compress,
+                   execute=args.execute, timeout=args.timeout)
+
+    def prepare(nb):
+        if args.remove_cells:
+            nb.remove_cells(*args.remove_cells)
+        if args.remove_code:
+            nb.remove_code()
+
+    if args.watch:
+        from .nbwatch import watch
+        return watch(lambda force=False: NbCollection(force=force, **options), prepare=prepare, force=args.force)
+
+    notebooks = NbCollection(force=args.force, **options)
 
     if args.lint:
         notebooks.lint()
     elif args.metadata:
         notebooks.metadata()
     elif args.search:
-        notebooks.search(args.search[0])
+        notebooks.search(args.search[0], outputs=args.search_outputs, count=args.count, as_json=args.json)
     elif args.tags:
-        notebooks.insert_subsection_numbers()
         for tag in list(sorted(notebooks.tag_index.keys(), key=str.casefold)):
             print(tag)
+    elif args.find:
+        notebooks.find(args.find, as_json=args.json)
+    elif args.query_tags:
+        try:
+            links = notebooks.query_tags(args.query_tags)
+        except ValueError as e:
+            print(e)
+            return 1
+        if args.json:
+            print(json.dumps({"query": args.query_tags, "count": len(links), "links": links,
+                              "tags": notebooks.tag_counts(args.query_tags)}))
+        elif args.count:
+            for tag, count in notebooks.tag_counts(args.query_tags).items():
+                print(f"{tag}: {count}")
+            print(f"{len(links)} sections match {args.query_tags}")
+        else:
+            for link in links:
+                print(link)
     elif args.get_cells:
-        print(notebooks.get_cells(args.get_cells[0]))
+        if len(args.get_cells) == 1 and not args.cells_dir:
+            print(notebooks.get_cells(args.get_cells[0]))
+        else:
+            notebooks.write_cells(args.get_cells, args.cells_dir or ".")
+    elif args.shard:
+        notebooks.publish_shard(*args.shard, prepare=prepare)
+    elif args.merge:
+        notebooks.merge_shards()
     else:
+        notebooks.execute_notebooks()
+        if args.variants is not None:
+            notebooks.publish_variants(args.variants)
         if args.remove_cells:
-            for tag in args.remove_cells:
-                notebooks.remove_cells(tag)
+            with timings.stage("remove_cells"):
+                notebooks.remove_cells(*args.remove_cells)
         if args.remove_code:
-            notebooks.remove_code()
+            with timings.stage("remove_code"):
+                notebooks.remove_code()
         if args.publish:
-            notebooks.insert_subsection_numbers()
-            notebooks.insert_headers()
-            notebooks.insert_navbars()
-            notebooks.insert_data_imports()
-            notebooks.remove("*.html")
-            notebooks.remove("*.ipynb")
-            notebooks.write_ipynb()
-            notebooks.write_toc()
-            notebooks.write_data_index()
-            notebooks.write_figure_index()
-            notebooks.write_tag_index()
-            notebooks.write_python_index()
-            notebooks.write_html()
-            notebooks.write_index_html()
+            notebooks.publish()
+
+    if args.timings:
+        timings.summary()
+        if isinstance(args.timings, str):
+            timings.write_json(args.timings)
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import pickle
+import tempfile
+
+# default cache location, relative to the top level directory of the repository
+CACHE_DIR = ".nbpages_cache"
+CACHE_MAX_MB = 256
+
+
+def nbpages_version():
+    """Return the installed version of nbpages."""
+    from importlib import metadata
+    try:
+        return metadata.version("nbpages")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+class ParseCache:
+    """Cache of objects derived from notebook files, keyed by path, mtime, size and nbpages version, or by a key.
+
+    Entries are .pickle files in the cache directory. The least recently used entries are removed when the
+    total size of the cache exceeds max_bytes. Other files in the cache directory are neither counted nor removed.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_MB * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.version = nbpages_version()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith(".pickle"))
+
+    def entry(self, path, kind):
+        """Return the cache file name for objects of a given kind derived from the file at path."""
+        st = os.stat(path)
+        return self.key_entry(f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}|{kind}")
+
+    def key_entry(self, key):
+        """Return the cache file name for an object stored under a key, such as a hash of its inputs."""
+        key = f"{self.version}|{key}"
+        return os.path.join(self.path, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".pickle")
+
+    def get(self, path, kind):
+        """Return the cached object of a given kind for the file at path, or None if not cached."""
+        return self.load(self.entry(path, kind))
+
+    def put(self, path, kind, obj):
+        """Store an object of a given kind for the file at path."""
+        self.store(self.entry(path, kind), obj)
+
+    def get_key(self, key):
+        """Return the object stored under a key, or None if not cached."""
+        return self.load(self.key_entry(key))
+
+    def put_key(self, key, obj):
+        """Store an object under a key."""
+        self.store(self.key_entry(key), obj)
+
+    def load(self, entry):
+        """Return the object in a cache file, marking it as recently used, or None if missing or unreadable."""
+        try:
+            with open(entry, 'rb') as f:
+                obj = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(entry)
+        return obj
+
+    def store(self, entry, obj):
+        """Write an object to a cache file, evicting old entries if the cache is full."""
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, entry)
+        self.size += os.path.getsize(entry)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is no larger than three quarters of max_bytes."""
+        entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in os.scandir(self.path) if entry.name.endswith(".pickle"))
+        self.size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self.size <= 0.75 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
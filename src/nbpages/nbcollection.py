@@ -1,27 +1,52 @@
 import re
+import ast
 import collections
+import functools
 import itertools
 import json
+import logging
 import configparser
+import contextlib
 import glob
+import hashlib
 import os
-import shutil
-import nbformat
-from nbformat.v4.nbbase import new_markdown_cell, new_notebook, new_code_cell
-from nbconvert import HTMLExporter
-from jinja2 import Environment, FileSystemLoader
+import pickle
+import warnings
+
+from .nbcache import ParseCache, CACHE_DIR, CACHE_MAX_MB
+from .nbfiles import (BROTLI_SUFFIX, GZIP_SUFFIX, compress_files, is_current_sibling, sync_files,
+                      write_if_changed)
+from .nbsearch import SearchIndex, search_file
+from .nbtiming import Timings, timed_call
+
+# nbformat, nbconvert and jinja2, and the templates module using them, are imported where they are used to keep
+# command line startup fast
+
+log = logging.getLogger(__name__)
+
+# sections of the configuration file defining variants of the site published by --variants
+VARIANT_SECTION = "variant:"
+
 
 def read_config():
 
-    global config
+    global config, variants
 
     # configuration file
     config_file = "nbpages.cfg"
     assert os.path.exists(config_file), f"configuration file {config_file} not found. Run nbpages --setup"
 
-    config = configparser.ConfigParser()
-    config.read(config_file)
-    config = config["nbpages"]
+    parser = configparser.ConfigParser()
+    parser.read(config_file)
+    config = parser["nbpages"]
+
+    # variants, each published to its own destination directory with tagged cells and solution code removed
+    variants = {section[len(VARIANT_SECTION):]: parser[section] for section in parser.sections()
+                if section.startswith(VARIANT_SECTION)}
+    for name, spec in variants.items():
+        assert "dst_dir" in spec, f"variant '{name}' has no dst_dir"
+        assert spec["dst_dir"] not in (config["src_dir"], config["dst_dir"]), \
+            f"destination directory of variant '{name}' must be different from the notebook and site directories"
 
     # source and destination directories
     assert config["src_dir"] != config["dst_dir"], "notebook source and destination directories must be different"
@@ -41,6 +66,69 @@ NB_FILENAME = re.compile(r'(\d\d|[A-Z])\.(\d\d)-(.*)\.ipynb')
 MARKDOWN_FIG = re.compile(r'(?:!\[(?P<txt>.*?)\]\((?P<url>.*?)\))')
 MARKDOWN_HEADER = re.compile(r'(^|\n)(?P<level>#{1,6})(?P<header>.*?)#*(\n|$)')
 MARKDOWN_LINK = re.compile(r'(?:[^!]\[(?P<txt>.*?)\]\((?P<url>.*?)\))')
+HTML_ANCHOR = re.compile(r'<a [^>]*>')
+HTML_IMG = re.compile(r'<img[^>]*>')
+
+# hierarchical tags and tag queries
+TAG_SEPARATOR = "::"
+TAG_QUERY_TOKEN = re.compile(r'[()]|[^\s()]+')
+TAG_QUERY_OPERATORS = ("AND", "OR", "NOT", "(", ")")
+
+# IPython syntax removed before parsing code cells for imports: magics, shell escapes and help requests on names
+IPYTHON_LINE = re.compile(r"^(\s*)(?:[%!].*|[\w.,\s]+=\s*[%!].*|\?{1,2}[\w.]+|[\w.]+\?{1,2})$")
+IMPORT_LINE = re.compile(r"^\s*(import|from)\s")
+PYTHON_CELL_MAGICS = ("%%time", "%%timeit", "%%capture", "%%prun")
+
+# version of the facts extracted from notebooks, increased when facts are added or changed
+FACTS_VERSION = 2
+
+# top-level metadata written by Jupyter after the cells, and the number of chunks at the end of a notebook file
+# searched for it before parsing the whole file
+METADATA_MARKER = b'\n "metadata": '
+METADATA_MAX_CHUNKS = 16
+
+# data and figure files
+DATA_SUFFIXES = ('.csv', '.txt')
+FIGURE_SUFFIXES = ('.png', '.jpg')
+FIGURE_EXCLUDE = ('.tex', '.pdf')
+
+# images of code cell outputs, written by --extract_images to a subdirectory of the destination figures directory
+# with file names given by the hash of their contents
+OUTPUT_IMAGES_SUBDIR = "_outputs"
+OUTPUT_IMAGE_SUFFIXES = {"image/png": ".png", "image/jpeg": ".jpg", "image/svg+xml": ".svg"}
+
+# build manifest recording the inputs of each published notebook
+MANIFEST_FILE = ".nbpages_manifest.json"
+MANIFEST_VERSION = 1
+
+# full text search index of notebook sections, kept in the cache directory under a name not evicted by ParseCache,
+# and its json form for the pages site
+SEARCH_INDEX_FILE = os.path.join(CACHE_DIR, "search_index.idx")
+SEARCH_JSON_FILE = "search_index.json"
+
+# seconds allowed for executing each notebook by --execute, and the kernel used if a notebook does not name one
+EXECUTE_TIMEOUT = 600
+DEFAULT_KERNEL = "python3"
+
+# published files given precompressed siblings by --compress
+COMPRESS_SUFFIXES = ('.html', '.ipynb', '.csv', '.json')
+
+# partial index written to the destination directory by each shard of a sharded publish, and merged by --merge
+SHARD_FILE = ".nbpages_shard_{index}_of_{count}.json"
+SHARD_PATTERN = ".nbpages_shard_*_of_*.json"
+
+# NbCollection methods run in order by nbpages --publish
+PUBLISH_STAGES = ("load", "insert_subsection_numbers", "insert_headers", "insert_navbars", "insert_data_imports",
+                  "remove_orphans", "write_ipynb", "write_toc", "write_data_index", "write_figure_index",
+                  "write_tag_index", "write_python_index", "write_html", "write_index_html", "write_search_json",
+                  "write_compressed", "write_manifest")
+
+# publish stages run by --merge after the notebooks of all shards are written
+MERGE_STAGES = ("remove_orphans", "write_toc", "write_data_index", "write_figure_index", "write_tag_index",
+                "write_python_index", "write_index_html", "write_search_json", "write_compressed", "write_manifest")
+
+# stems of the index pages rendered by write_md2html
+INDEX_PAGES = ("toc", "data_index", "figure_index", "tag_index", "python_index")
 
 
 # function to sort numbered section headings in natural order
@@ -48,13 +136,363 @@ def natsort(s):
     return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', s)]
 
 
+def text_hash(text):
+    """Return the sha256 hex digest of a string."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(path):
+    """Return the sha256 hex digest of a file's contents, or None if the file does not exist."""
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class AssetIndex:
+    """Find references to a set of file names in text using a single trie-structured regular expression."""
+
+    def __init__(self, names):
+        self.names = sorted(set(names), key=str.casefold)
+        trie = {}
+        for name in self.names:
+            node = trie
+            for ch in name:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+        # names that are prefixes of a longer name occur wherever the longer name occurs
+        names = set(self.names)
+        self.prefixes = {name: [name[:k] for k in range(1, len(name)) if name[:k] in names] for name in names}
+        self.regex = re.compile(f"(?=({self.pattern(trie)}))") if self.names else None
+
+    @classmethod
+    def pattern(cls, node):
+        """Return a regular expression for the names in a trie, preferring the longest match."""
+        branches = [re.escape(ch) + cls.pattern(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        group = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{group})?" if "" in node else group
+
+    def findall(self, text):
+        """Return the set of names occurring in text."""
+        found = set()
+        if self.regex:
+            for m in self.regex.finditer(text):
+                if m.group(1) not in found:
+                    found.add(m.group(1))
+                    found.update(self.prefixes[m.group(1)])
+        return found
+
+
+class TagIndex:
+    """Index of links to cells by tag, answering hierarchical and boolean queries.
+
+    Hierarchical tags are written as components separated by '::', such as 'author::FRB::Chapter-1'. A query term
+    matches every tag beginning with its components, so 'author' matches all author tags, and components may use
+    shell wildcards such as 'concept::Thiele*'. Terms are combined with AND, OR, NOT and parentheses, where
+    adjacent terms are combined with AND and NOT is taken relative to all tagged cells.
+    """
+
+    def __init__(self, tags):
+        self.links = {}
+        all_links = sorted(set(itertools.chain.from_iterable(tags.values())), key=natsort)
+        rank = {link: k for k, link in enumerate(all_links)}
+        for tag, links in tags.items():
+            self.links[tag] = sorted(set(links), key=rank.__getitem__)
+        self.rank = rank
+        self.prefixes = collections.defaultdict(set)
+        for tag in self.links:
+            path = self.path(tag)
+            for k in range(len(path) + 1):
+                self.prefixes[path[:k]].add(tag)
+
+    @staticmethod
+    def path(tag):
+        """Return the tuple of components of a hierarchical tag, ignoring empty components."""
+        return tuple(part for part in tag.split(TAG_SEPARATOR) if part)
+
+    def match(self, term):
+        """Return the set of tags matched by a query term."""
+        path = self.path(term)
+        while path and path[-1] == "*":
+            path = path[:-1]
+        if not any(ch in part for part in path for ch in "*?["):
+            return set(self.prefixes.get(path, ()))
+        import fnmatch
+        return {tag for tag in self.prefixes[()] if len(self.path(tag)) >= len(path)
+                and all(fnmatch.fnmatchcase(part, pattern) for part, pattern in zip(self.path(tag), path))}
+
+    def cells(self, term):
+        """Return the set of links to cells with any tag matched by a query term."""
+        return set(itertools.chain.from_iterable(self.links[tag] for tag in self.match(term)))
+
+    def query(self, expression):
+        """Return the sorted list of links to cells satisfying a query expression."""
+        result, terms = self.evaluate(expression)
+        return sorted(result, key=self.rank.__getitem__)
+
+    def evaluate(self, expression):
+        """Return the set of links to cells satisfying a query expression, and the list of terms not negated."""
+        tokens = [t.upper() if t.upper() in TAG_QUERY_OPERATORS else t for t in TAG_QUERY_TOKEN.findall(expression)]
+        terms = []
+        pos = 0
+
+        def peek():
+            return tokens[pos] if pos < len(tokens) else None
+
+        def advance():
+            nonlocal pos
+            pos += 1
+            return tokens[pos - 1]
+
+        def disjunction(negated):
+            result = conjunction(negated)
+            while peek() == "OR":
+                advance()
+                result |= conjunction(negated)
+            return result
+
+        def conjunction(negated):
+            result = negation(negated)
+            while peek() not in (None, "OR", ")"):
+                if peek() == "AND":
+                    advance()
+                result &= negation(negated)
+            return result
+
+        def negation(negated):
+            token = peek()
+            if token == "NOT":
+                advance()
+                return set(self.rank) - negation(not negated)
+            if token == "(":
+                advance()
+                result = disjunction(negated)
+                if peek() != ")":
+                    raise ValueError(f"missing ) in tag query '{expression}'")
+                advance()
+                return result
+            if token in (None, ")", "AND", "OR"):
+                raise ValueError(f"expected a tag at position {pos + 1} of tag query '{expression}'")
+            term = advance()
+            if not negated:
+                terms.append(term)
+            return self.cells(term)
+
+        result = disjunction(False)
+        if pos < len(tokens):
+            raise ValueError(f"unexpected '{tokens[pos]}' in tag query '{expression}'")
+        return result, terms
+
+    def counts(self, expression=None):
+        """Return a dictionary of the number of cells with each tag matched by terms not negated, or all tags."""
+        if expression is None:
+            tags = self.links.keys()
+        else:
+            result, terms = self.evaluate(expression)
+            tags = set(itertools.chain.from_iterable(self.match(term) for term in terms))
+        return {tag: len(self.links[tag]) for tag in sorted(tags, key=str.casefold)}
+
+
+# asset indexes are built once per run for each directory, and cleared when a collection is created
+_asset_indexes = {}
+_facts_signature = None
+
+
+def clear_caches():
+    """Discard directory listings and signatures cached by a previous collection."""
+    global _facts_signature
+    _asset_indexes.clear()
+    _facts_signature = None
+
+
+def asset_index(dirpath, suffixes=None, exclude=()):
+    """Return an AssetIndex for the visible files in a directory with any of the given suffixes."""
+    key = (os.path.abspath(dirpath), suffixes, exclude)
+    if key not in _asset_indexes:
+        assert os.path.exists(dirpath), f"- subdirectory {dirpath} was not found"
+        _asset_indexes[key] = AssetIndex(f for f in os.listdir(dirpath)
+                                         if os.path.isfile(os.path.join(dirpath, f)) and not f.startswith('.')
+                                         and (suffixes is None or f.endswith(suffixes)) and not f.endswith(exclude))
+    return _asset_indexes[key]
+
+
+def read_metadata(path, chunk_size=65536, max_chunks=METADATA_MAX_CHUNKS):
+    """Return the top-level metadata of a notebook file, parsing only the end of the file when possible.
+
+    Notebooks written by Jupyter place the top-level metadata after the cells, with one space of indentation. The
+    last max_chunks chunks of the file are searched for it, each once. Files in any other layout are parsed in full.
+    """
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        for _ in range(max_chunks):
+            if end <= 0:
+                break
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            # overlap the chunk searched before by the length of the marker, less one
+            k = f.read(min(size, end + len(METADATA_MARKER) - 1) - start).rfind(METADATA_MARKER)
+            if k >= 0:
+                f.seek(start + k)
+                try:
+                    metadata, _ = json.JSONDecoder().raw_decode(f.read().decode("utf-8"), len(METADATA_MARKER))
+                except ValueError:
+                    break
+                return metadata
+            end = start
+        f.seek(0)
+        return json.load(f)["metadata"]
+
+
+def facts_signature():
+    """Return a hash of the configuration and file listings on which the facts extracted from notebooks depend."""
+    global _facts_signature
+    if _facts_signature is None:
+        data_files = asset_index(os.path.join(config["src_dir"], config["data_subdir"]), DATA_SUFFIXES)
+        figure_files = asset_index(os.path.join(config["src_dir"], config["figures_subdir"]), None, FIGURE_EXCLUDE)
+        _facts_signature = text_hash(json.dumps([FACTS_VERSION, dict(config), data_files.names, figure_files.names],
+                                                sort_keys=True))
+    return _facts_signature
+
+
+def strip_magics(source):
+    """Return python source with IPython magics, shell escapes and help requests replaced by pass statements.
+
+    Cells run by a cell magic are returned empty, except for magics timing or capturing python code.
+    """
+    lines = source.splitlines()
+    if lines and lines[0].startswith("%%"):
+        if lines[0].split()[0] not in PYTHON_CELL_MAGICS:
+            return ""
+        lines = lines[1:]
+    return "\n".join(IPYTHON_LINE.sub(r"\1pass", line) for line in lines)
+
+
+@functools.lru_cache(maxsize=2**14)
+def cell_imports(source):
+    """Return a tuple of the modules and names imported by the source of a code cell.
+
+    Names imported from a module are given as module.name. Cells that cannot be parsed, even with IPython magics
+    removed, are read line by line so that single line imports are still found.
+    """
+    # invalid escape sequences in strings are reported by the parser, as SyntaxWarning from python 3.12
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            tree = ast.parse(strip_magics(source))
+        except (SyntaxError, ValueError):
+            tree = ast.Module(body=[], type_ignores=[])
+            for line in source.splitlines():
+                if IMPORT_LINE.match(line):
+                    try:
+                        tree.body.extend(ast.parse(line.strip()).body)
+                    except (SyntaxError, ValueError):
+                        pass
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            module = "." * node.level + (node.module or "")
+            imports.extend(f"{module}{'' if module.endswith('.') else '.'}{alias.name}" for alias in node.names)
+    return tuple(dict.fromkeys(imports))
+
+
+def extract_output_images(content, images_dir, images_url):
+    """Write the images of code cell outputs to files in images_dir named by the sha256 digest of their data.
+
+    Return a copy of content in which the outputs refer to the files at images_url, and a dictionary of the
+    image file names with True for files written and False for files already present.
+    """
+    import base64
+    import copy
+    content = copy.deepcopy(content)
+    images = {}
+    for cell in content.cells:
+        for output in cell.get("outputs", []):
+            for mime, suffix in OUTPUT_IMAGE_SUFFIXES.items():
+                if mime not in output.get("data", {}):
+                    continue
+                data = output.data[mime]
+                data = data.encode("utf-8") if suffix == ".svg" else base64.b64decode(data)
+                name = hashlib.sha256(data).hexdigest() + suffix
+                if name not in images:
+                    path = os.path.join(images_dir, name)
+                    images[name] = not os.path.isfile(path) and write_if_changed(path, data)
+                url = f"{images_url}/{name}"
+                output.setdefault("metadata", {}).setdefault("filenames", {})[mime] = url
+                if suffix == ".svg":
+                    output.svg_filename = url
+    return content, images
+
+
+def export_html(content, html_path, template_file, variables, bytecode_dir=None, images_dir=None):
+    """Render notebook content to html and write to html_path if changed. Safe to run in a worker process.
+
+    If images_dir is given, output images are written to files in images_dir and linked from the html rather than
+    embedded in it. Return True if the html was written, and the dictionary of image files from extract_output_images.
+    """
+    from .nbtemplates import html_exporter
+    images = {}
+    if images_dir:
+        images_url = os.path.relpath(images_dir, os.path.dirname(html_path)).replace(os.sep, "/")
+        content, images = extract_output_images(content, images_dir, images_url)
+    exporter = html_exporter(template_file, bytecode_dir)
+    exporter.environment.globals.update(variables)
+    (body, resources) = exporter.from_notebook_node(content)
+    return write_if_changed(html_path, body), images
+
+
+def kernel_name(content):
+    """Return the name of the kernel used to execute notebook content."""
+    return content.metadata.get("kernelspec", {}).get("name", DEFAULT_KERNEL)
+
+
+def execute_notebook(content, kernel, timeout, cwd):
+    """Execute a copy of notebook content with a kernel started in cwd. Safe to run in a worker process.
+
+    The notebook is allowed timeout seconds. Errors raised by cells are kept in their outputs. Return a list of the
+    outputs and execution count of each code cell and None, or None and a message if the kernel could not be run or
+    the notebook timed out.
+    """
+    import asyncio
+    import copy
+    from nbclient import NotebookClient
+    content = copy.deepcopy(content)
+    client = NotebookClient(content, timeout=timeout, kernel_name=kernel, allow_errors=True)
+    try:
+        asyncio.run(asyncio.wait_for(client.async_execute(cwd=cwd), timeout))
+    except asyncio.TimeoutError:
+        return None, f"timed out after {timeout} s"
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+    return [(cell.outputs, cell.execution_count) for cell in content.cells if cell.cell_type == "code"], None
+
+
+def export_ipynb(content, ipynb_path):
+    """Write notebook content to ipynb_path if changed. Safe to run in a worker process."""
+    import nbformat
+    source = nbformat.writes(content)
+    return write_if_changed(ipynb_path, source if source.endswith("\n") else source + "\n")
+
+
 class Nb:
 
+    # optional ParseCache shared by the notebooks of a collection
+    cache = None
+
     def __init__(self, filename, chapter, section):
         self.filename = filename
         self.chapter = str(int(chapter)) if chapter.isdigit() else chapter
         self.section = str(int(section))
-        self.content = nbformat.read(os.path.join(config["src_dir"], filename), as_version=4)
+        self.path = os.path.join(config["src_dir"], filename)
+        self.numbered = False
+        self.modified = False
+        self._content = None
+        self._source_hash = None
+        self._facts = None
         self.html_filename = os.path.splitext(self.filename)[0] + ".html"
         self.html_url = f"{config['github_pages_url']}/{self.html_filename}"
 
@@ -64,35 +502,70 @@ class Nb:
     def __str__(self):
         return self.filename
 
+    @property
+    def content(self):
+        """Return the notebook content, reading the notebook file on first access."""
+        if self._content is None:
+            cached = self.cache.get(self.path, "content") if self.cache else None
+            if cached:
+                self._source_hash, self._content = cached
+            else:
+                import nbformat
+                with open(self.path, encoding="utf-8") as f:
+                    source = f.read()
+                self._source_hash = text_hash(source)
+                self._content = nbformat.reads(source, as_version=4)
+                if self.cache:
+                    self.cache.put(self.path, "content", (self._source_hash, self._content))
+        return self._content
+
+    @property
+    def metadata(self):
+        """Return the notebook metadata, reading only the end of the notebook file if content is not loaded."""
+        if self._content is None:
+            return read_metadata(self.path)
+        return self._content.metadata
+
+    @property
+    def source_hash(self):
+        """Return the sha256 hex digest of the notebook file as read."""
+        self.content
+        return self._source_hash
+
     @property
     def data_import_links(self):
         """Return list of (datapath, url) pairs."""
-        dirpath = os.path.join(config["src_dir"], config["data_subdir"])
-        assert os.path.exists(dirpath), f"- data subdirectory {dirpath} was not found"
-        data = [f for f in os.listdir(dirpath) if os.path.isfile(os.path.join(dirpath, f))
-                and not f.startswith('.') and f.endswith('.csv') or f.endswith('.txt')]
-        data = filter(lambda f: any([re.search(f, cell.source) for cell in self.content.cells]), data)
+        data = sorted(self.facts["data"], key=str.casefold)
         return [(os.path.join(config["data_subdir"], f), f"{config['github_pages_url']}/data/{f}") for f in data]
 
+    @property
+    def facts(self):
+        """Return dictionary of facts extracted from the cells, scanning the cells on first access."""
+        if self._facts is None and self.cache and not self.modified:
+            cached = self.cache.get(self.path, "facts")
+            if cached and cached[0] == facts_signature():
+                self._facts = cached[1]
+        if self._facts is None:
+            self._facts = self.scan()
+            if self.cache and not self.modified:
+                self.cache.put(self.path, "facts", (facts_signature(), self._facts))
+        return self._facts
+
     @property
     def figure_links(self):
         """Return list of (fig, url) pairs."""
-        dirpath = os.path.join(config["src_dir"], config["figures_subdir"])
-        assert os.path.exists(dirpath), f"- figures subdirectory {dirpath} was not found"
-        figures = [f for f in os.listdir(dirpath) if os.path.isfile(os.path.join(dirpath, f))
-                and not f.startswith('.') and not f.endswith('.tex') and not f.endswith('.pdf')]
-        figures = filter(lambda f: any([re.search(f, cell.source) for cell in self.content.cells]), figures)
+        figures = sorted(self.facts["figures"], key=str.casefold)
         return [(os.path.join(config["figures_subdir"], figure), f"{config['github_pages_url']}/figures/{figure}") for figure in figures]
 
     @property
     def html_anchor_tags(self):
         """Return a list of html anchor tags."""
-        return self.findall_markdown_cells(r'<a [^>]*>')
+        return self.facts["html_anchor_tags"]
 
     @property
     def html_img_tags(self):
         """Return a list of html img tags."""
-        return self.findall_markdown_cells(r'<img[^>]*>')
+        return self.facts["html_img_tags"]
 
     @property
     def link(self):
@@ -102,91 +575,143 @@ class Nb:
     @property
     def markdown_figs(self):
         """Return a list of markdown figures in the markdown cells."""
-        return self.findall_markdown_cells(MARKDOWN_FIG)
+        return self.facts["markdown_figs"]
 
     @property
     def markdown_links(self):
         """Return a list of markdown links in the markdown cells."""
-        return self.findall_markdown_cells(MARKDOWN_LINK)
+        return self.facts["markdown_links"]
 
     @property
     def orphan_headers(self):
         """"Return a list of headers not in the first line of a cell."""
-        orphans = []
-        for cell in self.markdown_cells():
-            orphans.extend([line for line in cell.source.splitlines()[1:] if MARKDOWN_HEADER.match(line)])
-        return orphans
+        return self.facts["orphan_headers"]
 
     @property
     def output_errors(self):
-        output_errors = []
-        for cell in self.content.cells:
-            if cell.cell_type == "code":
-                for output in cell.outputs:
-                    if output["output_type"] == "error":
-                        output_errors.append(f"{output['ename']}: {output['evalue']}")
-                    if "name" in output.keys():
-                        if output["name"] == "stderr":
-                            output_errors.append(f"{output['name']}: {output['text'].splitlines()[0]}")
-        return output_errors
+        """Return a list of errors and stderr messages found in the outputs of code cells."""
+        return self.facts["output_errors"]
 
     @property
     def tags(self):
         """Return a dictionary with tags as keys and a list of cell links as values."""
-        tags = collections.defaultdict(list)
-        for cell in self.content.cells:
-            if 'tags' in cell.metadata.keys():
-                for tag in cell.metadata['tags']:
-                    tags[tag].append(cell.metadata["nbpages"]["link"])
-        return tags
+        return self.facts["tags"]
 
     @property
     def title(self):
         """Return notebook title by extracting the first level one header."""
-        for cell in self.markdown_cells():
-            m = MARKDOWN_HEADER.match(cell.source)
-            if m and len(m.group('level')) == 1:
-                return m.group('header').strip()
-        return None
+        return self.facts["title"]
 
     @property
     def toc(self):
         """Return formatted list of markdown links to cells starting with a markdown header."""
-        toc = []
-        header_cells = (cell for cell in self.markdown_cells() if cell.source.startswith("##"))
-        for header_cell in header_cells:
-            header = header_cell.source.splitlines()[0].strip().split()
-            txt = ' '.join(header[1:])
-            url = '#'.join([self.html_url, '-'.join(header[1:])])
-            toc.append("    " * (len(header[0]) - 2) + f"- [{txt}]({url})")
-        return toc
-
-    def findall_markdown_cells(self, regex):
-        return [s for cell in self.markdown_cells() for s in re.findall(regex, cell.source)]
-
-    def insert_subsection_numbers(self):
+        return list(self.facts["toc"])
+
+    def set_outputs(self, results):
+        """Replace the outputs and execution counts of the code cells with a list of (outputs, count) pairs."""
+        code_cells = [cell for cell in self.content.cells if cell.cell_type == "code"]
+        changed = False
+        for cell, (outputs, count) in zip(code_cells, results):
+            if cell.outputs != outputs or cell.execution_count != count:
+                cell.outputs = outputs
+                cell.execution_count = count
+                changed = True
+        if changed:
+            self.invalidate()
+
+    def invalidate(self):
+        """Discard facts extracted from the cells. Must be called after the cells are changed."""
+        self.modified = True
+        self._facts = None
+
+    def reload(self):
+        """Discard the content and facts so the notebook file is read again on next access."""
+        self.numbered = False
+        self.modified = False
+        self._content = None
+        self._source_hash = None
+        self._facts = None
+
+    def scan(self):
+        """Return a dictionary of facts extracted from the cells in a single pass."""
+        facts = {"data": {}, "figures": {}, "html_anchor_tags": [], "html_img_tags": [], "imports": {},
+                 "markdown_figs": [], "markdown_links": [], "orphan_headers": [], "output_errors": [], "tags": {},
+                 "title": None, "toc": []}
+        data_files = asset_index(os.path.join(config["src_dir"], config["data_subdir"]), DATA_SUFFIXES)
+        figure_files = asset_index(os.path.join(config["src_dir"], config["figures_subdir"]), None, FIGURE_EXCLUDE)
+        for cell, link in self.cell_links():
+            for tag in cell.metadata.get("tags", []):
+                facts["tags"].setdefault(tag, []).append(link)
+            for data in data_files.findall(cell.source):
+                facts["data"].setdefault(data, []).append(link)
+            for figure in figure_files.findall(cell.source):
+                facts["figures"].setdefault(figure, []).append(link)
+            if cell.cell_type == "code":
+                for name in cell_imports(cell.source):
+                    facts["imports"].setdefault(name, []).append(link)
+                for output in cell.outputs:
+                    if output["output_type"] == "error":
+                        facts["output_errors"].append(f"{output['ename']}: {output['evalue']}")
+                    if output.get("name") == "stderr":
+                        facts["output_errors"].append(f"{output['name']}: {output['text'].splitlines()[0]}")
+            elif self.is_markdown(cell):
+                source = cell.source
+                facts["html_anchor_tags"].extend(HTML_ANCHOR.findall(source))
+                facts["html_img_tags"].extend(HTML_IMG.findall(source))
+                facts["markdown_figs"].extend(MARKDOWN_FIG.findall(source))
+                facts["markdown_links"].extend(MARKDOWN_LINK.findall(source))
+                lines = source.splitlines()
+                facts["orphan_headers"].extend(line for line in lines[1:] if MARKDOWN_HEADER.match(line))
+                if facts["title"] is None:
+                    m = MARKDOWN_HEADER.match(source)
+                    if m and len(m.group('level')) == 1:
+                        facts["title"] = m.group('header').strip()
+                if source.startswith("##"):
+                    header = lines[0].strip().split()
+                    txt = ' '.join(header[1:])
+                    url = '#'.join([self.html_url, '-'.join(header[1:])])
+                    facts["toc"].append("    " * (len(header[0]) - 2) + f"- [{txt}]({url})")
+        return facts
+
+    def sections(self):
+        """Iterate over cells yielding (cell, header match, level, section, link) for numbered subsections."""
         subsection_number_root = f"{self.chapter}.{self.section}"
         subsection_level = 0
         header_numbers = [0] * 6
         subsection_header = ""
         subsection_url = self.html_url
         for cell in self.content.cells:
-            if cell.cell_type == "markdown":
-                m = MARKDOWN_HEADER.match(cell.source)
-                if m:
-                    subsection_level = len(m.group('level'))
-                    header_numbers[subsection_level - 1] += 1
-                    header_numbers[subsection_level:] = [0] * (6 - subsection_level)
-                    subsection_header = subsection_number_root \
-                                        + "".join(f".{int(n)}" for n in header_numbers[1:] if n > 0) \
-                                        + m.group("header")
-                    subsection_url = '#'.join([self.html_url, '-'.join(subsection_header.strip().split())])
-                    cell.source = cell.source[:m.start("header")] + " " + subsection_header + cell.source[m.end("header"):]
+            m = MARKDOWN_HEADER.match(cell.source) if cell.cell_type == "markdown" else None
+            if m:
+                subsection_level = len(m.group('level'))
+                header_numbers[subsection_level - 1] += 1
+                header_numbers[subsection_level:] = [0] * (6 - subsection_level)
+                subsection_header = subsection_number_root \
+                                    + "".join(f".{int(n)}" for n in header_numbers[1:] if n > 0) \
+                                    + m.group("header")
+                subsection_url = '#'.join([self.html_url, '-'.join(subsection_header.strip().split())])
+            yield cell, m, subsection_level, subsection_header, f"[{subsection_header}]({subsection_url})"
+
+    def cell_links(self):
+        """Iterate over cells yielding (cell, link), where link is the subsection link assigned to the cell."""
+        if self.numbered:
+            for cell in self.content.cells:
+                yield cell, cell.metadata["nbpages"]["link"] if "nbpages" in cell.metadata else None
+        else:
+            for cell, m, level, section, link in self.sections():
+                yield cell, link
+
+    def insert_subsection_numbers(self):
+        for cell, m, level, section, link in self.sections():
+            if m:
+                cell.source = cell.source[:m.start("header")] + " " + section + cell.source[m.end("header"):]
             cell.metadata["nbpages"] = {
-                "level": subsection_level,
-                "section": subsection_header,
-                "link": f"[{subsection_header}]({subsection_url})"
+                "level": level,
+                "section": section,
+                "link": link
             }
+        self.numbered = True
+        self.invalidate()
 
     def get_cells(self, tag):
         """Return a list of all cells with a specified tag."""
@@ -207,19 +732,48 @@ class Nb:
                     for s in lint:
                         print(f"        {s}")
 
+    def is_markdown(self, cell):
+        """Return True for markdown cells other than navbars and header."""
+        return cell.cell_type == "markdown" and not cell.source.startswith(NOTEBOOK_HEADER_TAG) \
+            and not cell.source.startswith(NAVBAR_TAG)
+
     def markdown_cells(self):
         """Iterator for all markdown cells excluding navbars and header"""
         for cell in self.content.cells:
-            if cell.cell_type == "markdown" and not cell.source.startswith(NOTEBOOK_HEADER_TAG) \
-                    and not cell.source.startswith(NAVBAR_TAG):
+            if self.is_markdown(cell):
                 yield cell
 
-    def remove_cells(self, tag):
-        """Remove cells with a specified tag."""
-        tagged_cells = self.get_cells(tag)
-        if tagged_cells:
-            print(f"- removing cells tagged {tag} from {self.filename}")
-            self.content.cells = filter(lambda cell: cell not in tagged_cells, self.content.cells)
+    def get_cells_by_tag(self, tags):
+        """Return a dictionary of lists of the cells with each of the specified tags, in a single pass over the cells."""
+        tags = set(tags)
+        cells = {tag: [] for tag in tags}
+        for cell in self.content.cells:
+            for tag in tags.intersection(cell.metadata.get("tags", [])):
+                cells[tag].append(cell)
+        return cells
+
+    def remove_cells(self, *tags):
+        """Remove cells with any of the specified tags."""
+        tags = set(tags)
+        cells = [cell for cell in self.content.cells if tags.isdisjoint(cell.metadata.get("tags", []))]
+        if len(cells) < len(self.content.cells):
+            log.info("- removing cells tagged %s from %s", ", ".join(sorted(tags)), self.filename,
+                     extra={"action": "removing cells", "notebook": self.filename})
+            self.content.cells = cells
+            self.invalidate()
+
+    def stable_id(self, cell, cell_id):
+        """Replace the random id of a cell inserted by nbpages so repeated publishes give identical notebooks."""
+        if self.content.nbformat_minor >= 5:
+            cell.id = cell_id
+        else:
+            cell.pop("id", None)
+        return cell
+
+    def remove_code(self):
+        """Replace solution code and hidden tests in code cells."""
+        self.replace_code(SOLUTION_CODE, "# YOUR SOLUTION HERE")
+        self.replace_code(HIDDEN_TESTS, "")
 
     def replace_code(self, pattern, repl):
         """Find and replace a regular expression from code cells."""
@@ -227,7 +781,8 @@ class Nb:
         for cell in self.content.cells:
             if cell.cell_type == "code" and regex.findall(cell.source):
                 cell.source = regex.sub(repl, cell.source)
-                print(f"- code removed from {self.filename}")
+                log.info("- code removed from %s", self.filename, extra={"action": "removing code", "notebook": self.filename})
+                self.invalidate()
 
 
 class FrontMatter(Nb):
@@ -304,10 +859,12 @@ class Section(Nb):
 
 class NbCollection:
 
-    def __init__(self, src_dir=None, dst_dir=None):
+    def __init__(self, src_dir=None, dst_dir=None, force=False, jobs=1, cache=False, timings=None, search_json=False,
+                 extract_images=False, compress=False, execute=False, timeout=None):
         read_config()
+        clear_caches()
         for k in config.keys():
-            print(k, config[k])
+            log.debug("%s %s", k, config[k])
         self.notebooks = []
         self.src_dir = src_dir if src_dir else config["src_dir"]
         self.dst_dir = dst_dir if dst_dir else config["dst_dir"]
@@ -323,102 +880,381 @@ class NbCollection:
                 else:
                     self.notebooks.append(Appendix(filename, chapter, section))
 
+        # optional persistent cache of parsed notebooks and extracted facts
+        self.cache = ParseCache(max_bytes=int(config.get("cache_max_mb", CACHE_MAX_MB)) * 2**20) if cache else None
+        for nb in self.notebooks:
+            nb.cache = self.cache
+
         # property caches
         self._data = []
         self._data_index = {}
         self._figures = []
         self._figure_index = {}
-        self._tag_index = collections.defaultdict(list)
+        self._python_index = None
+        self._tag_tree = None
+
+        # build manifest, ignored when force is set so that every output is rewritten
+        self.force = force
+        self._manifest = None
+        self._build_keys = {}
+
+        # number of worker processes used for per-notebook rendering, and a pool kept open by process_pool()
+        self.jobs = jobs
+        self.executor = None
+
+        # write a json search index to the destination directory when publishing, from the section texts recorded by
+        # the shards when merging a sharded publish
+        self.search_json = search_json
+        self.shard_sections = None
+
+        # whether any notebook has tagged cells, found by publish_shard without reading every notebook
+        self.shard_tagged = None
+
+        # write output images to files linked from the html pages, and the image files used by each notebook
+        self.extract_images = extract_images
+        self.images_dir = os.path.join(self.dst_dir, config["figures_subdir"], OUTPUT_IMAGES_SUBDIR)
+        self._images = None
+
+        # write gzip and brotli compressed siblings of the published files, and the siblings written by nbpages
+        self.compress = compress
+        self._compressed = None
+
+        # execute notebooks before publishing, allowing each notebook timeout seconds
+        self.execute = execute
+        self.timeout = timeout if timeout else EXECUTE_TIMEOUT
+
+        # timings of stages and notebooks
+        self.timings = timings if timings else Timings()
+
+        # files written and files left unchanged by the current publish
+        self.written = []
+        self.unchanged = []
+
+        # compiled templates are kept with the parse cache when it is enabled
+        self.bytecode_dir = os.path.join(self.cache.path, "jinja") if self.cache else None
 
     def get_files(self, sub_dir, suffixes):
-        """Return an iterator over the file names in a notebooks subdirectory which have any of the given suffixes"""
-        path = os.path.join(self.src_dir, sub_dir)
-        for f in os.listdir(path):
-            if os.path.isfile(os.path.join(path, f)) and not f.startswith('.') and any(list(map(f.endswith, suffixes))):
-                yield f
-
-    def index_terms(self, terms):
-        """Return a dictionary of deduplicated links to cells indexed by the entries in terms."""
-        index = dict()
-        for term in terms:
-            links = [cell.metadata["nbpages"]["link"] for nb in self.notebooks
-                     for cell in nb.content.cells if re.search(term, cell.source) if "nbpages" in cell.metadata.keys()]
-            index[term] = list(dict.fromkeys(links))
-        return index
+        """Return a list of the file names in a notebooks subdirectory which have any of the given suffixes"""
+        return asset_index(os.path.join(self.src_dir, sub_dir), tuple(suffixes)).names
+
+    def map(self, func, args, names=None):
+        """Return list of func(*a) for each tuple a in args, in order, using a process pool if jobs > 1.
+
+        If a list of notebook names is given, the time of each call is recorded for that notebook in the
+        current stage.
+        """
+        args = list(args)
+        if names is not None:
+            args = [(func, *a) for a in args]
+            func = timed_call
+        results = None
+        if self.jobs > 1 and len(args) > 1:
+            import concurrent.futures
+            try:
+                if self.executor:
+                    results = list(self.executor.map(func, *zip(*args)))
+                else:
+                    with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.jobs, len(args))) as executor:
+                        results = list(executor.map(func, *zip(*args)))
+            except (OSError, NotImplementedError, concurrent.futures.process.BrokenProcessPool) as e:
+                log.warning("- process pool failed (%s), continuing with a single process", e)
+        if results is None:
+            results = [func(*a) for a in args]
+        if names is not None:
+            for name, (result, wall, cpu) in zip(names, results):
+                self.timings.record(name, wall, cpu)
+            results = [result for result, wall, cpu in results]
+        return results
+
+    @contextlib.contextmanager
+    def process_pool(self):
+        """Context manager keeping one pool of worker processes for all calls of map, if jobs > 1."""
+        if self.jobs <= 1 or self.executor:
+            yield
+            return
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as self.executor:
+            try:
+                yield
+            finally:
+                self.executor = None
+
+    def reset_indexes(self):
+        """Discard the indexes built from the facts of the notebooks."""
+        self._data_index = {}
+        self._figure_index = {}
+        self._python_index = None
+        self._tag_tree = None
+
+    def index_facts(self):
+        """Return a dictionary of the facts on which each index page depends, indexed by the stage writing the page."""
+        return {
+            "write_toc": [(nb.filename, nb.toc, nb.markdown_figs, nb.markdown_links, list(nb.tags), nb.figure_links)
+                          for nb in self.notebooks],
+            "write_data_index": self.data_index,
+            "write_figure_index": self.figure_index,
+            "write_tag_index": self.tag_index,
+            "write_python_index": self.python_index,
+            "write_index_html": [nb.link for nb in self.notebooks],
+        }
+
+    def rebuild(self, changed=(), prepare=None, copy_assets=False):
+        """Reload changed notebooks with prepare applied, and rewrite only the outputs depending on them."""
+        before = self.index_facts()
+        titles = {nb.filename: nb.title for nb in self.notebooks}
+        has_tags = bool(self.tag_index)
+        for nb in changed:
+            nb.reload()
+        self.execute_notebooks(changed)
+        for nb in changed:
+            if prepare:
+                prepare(nb)
+            nb.insert_subsection_numbers()
+        self.reset_indexes()
+        affected = set(changed)
+        for k, nb in enumerate(self.notebooks):
+            if nb.title != titles[nb.filename]:
+                affected.update(self.notebooks[max(0, k - 1):k + 2])
+        if bool(self.tag_index) != has_tags:
+            affected.update(self.notebooks)
+        affected = [nb for nb in self.notebooks if nb in affected]
+        self.insert_headers(affected)
+        self.insert_navbars(affected)
+        self.insert_data_imports(affected)
+        for nb in affected:
+            self._build_keys.pop(nb.filename, None)
+        after = self.index_facts()
+        stages = {stage for stage in after if after[stage] != before[stage]}
+        if stages:
+            stages.add("write_index_html")
+        if copy_assets:
+            stages.update(["write_data_index", "write_figure_index"])
+        stages.update(["write_ipynb", "write_html", "write_search_json", "write_manifest", "write_compressed"])
+        self.run_stages(stages)
+
+    def index_files(self, key, files):
+        """Return a dictionary of deduplicated links to cells referencing each file, indexed by file name."""
+        index = {f: [] for f in files}
+        for nb in self.notebooks:
+            for f, links in nb.facts[key].items():
+                if f in index:
+                    index[f].extend(link for link in links if link)
+        return {f: list(dict.fromkeys(links)) for f, links in index.items()}
+
+    def unused_files(self, key, files):
+        """Return a sorted list of files not referenced by any notebook."""
+        used = set(itertools.chain.from_iterable(nb.facts[key] for nb in self.notebooks))
+        return sorted([f for f in files if f not in used], key=str.casefold)
+
+    @property
+    def manifest(self):
+        """Return dictionary of build keys recorded by the previous publish, indexed by notebook filename."""
+        if self._manifest is None:
+            self.read_manifest()
+        return self._manifest
+
+    @property
+    def images(self):
+        """Return dictionary of the output image files linked from each html page, indexed by notebook filename."""
+        if self._images is None:
+            self.read_manifest()
+        return self._images
+
+    @property
+    def compressed(self):
+        """Return sorted list of the compressed siblings written by nbpages, relative to the destination directory."""
+        if self._compressed is None:
+            self.read_manifest()
+        return self._compressed
+
+    def read_manifest(self):
+        """Read the build keys, output images and compressed siblings recorded by the previous publish.
+
+        Build keys and output images are ignored if force is set. Values already set are left in place.
+        """
+        manifest = {}
+        path = os.path.join(self.dst_dir, MANIFEST_FILE)
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    manifest = json.load(f)
+            except ValueError:
+                log.warning("- ignoring unreadable build manifest %s", path)
+            if manifest.get("version") != MANIFEST_VERSION:
+                manifest = {}
+        previous = {} if self.force else manifest
+        if self._manifest is None:
+            self._manifest = previous.get("notebooks", {})
+        if self._images is None:
+            self._images = previous.get("images", {})
+        if self._compressed is None:
+            self._compressed = manifest.get("compressed", [])
+
+    def build_key(self, nb):
+        """Return a dictionary of hashes describing all inputs to the published outputs of a notebook."""
+        if nb.filename not in self._build_keys:
+            import nbconvert
+            k = self.notebooks.index(nb)
+            prev_nb = self.notebooks[k - 1] if k > 0 else None
+            next_nb = self.notebooks[k + 1] if k + 1 < len(self.notebooks) else None
+            template = os.path.join(config["templates_dir"], "notebook.tpl")
+            self._build_keys[nb.filename] = {
+                "source": nb.source_hash,
+                "content": text_hash(json.dumps(nb.content, sort_keys=True)),
+                "template": file_hash(template),
+                "config": text_hash(json.dumps(dict(config), sort_keys=True) + nbconvert.__version__),
+                "neighbours": [prev_nb.title if prev_nb else None, next_nb.title if next_nb else None],
+            }
+            if self.extract_images:
+                self._build_keys[nb.filename]["images"] = OUTPUT_IMAGES_SUBDIR
+        return self._build_keys[nb.filename]
+
+    def is_current(self, nb, path):
+        """Return True if path exists and was built by a previous publish from unchanged inputs."""
+        return os.path.isfile(path) and self.manifest.get(nb.filename) == self.build_key(nb)
+
+    def has_images(self, nb):
+        """Return True if the output image files linked from the html page of a notebook exist."""
+        return all(os.path.isfile(os.path.join(self.images_dir, name)) for name in self.images.get(nb.filename, []))
 
     @property
     def data_index(self):
         """Return deduplicated dictionary of links indexed by data file names."""
         if not self._data_index:
-            self._data_index = self.index_terms(self.get_files(config["data_subdir"], ['.csv', '.txt']))
+            self._data_index = self.index_files("data", self.get_files(config["data_subdir"], DATA_SUFFIXES))
         return self._data_index
 
     @property
     def figure_index(self):
         """Return deduplicated dictionary of links indexed by figure file names."""
         if not self._figure_index:
-            self._figure_index  = self.index_terms(self.get_files(config["figures_subdir"], ['.png', '.jpg']))
+            self._figure_index = self.index_files("figures", self.get_files(config["figures_subdir"], FIGURE_SUFFIXES))
         return self._figure_index
 
     @property
     def python_index(self):
-        python_index = collections.defaultdict(list)
-        IMPORT_AS = re.compile(r"^\s*import\s+((?P<module>\w[\w|\.]*)\s+as\s+(?P<name>\w+))")
-        IMPORT = re.compile(r"^\s*import\s+(?P<txt>[*|\w+][,\s*\w+]*)")
-        FROM = re.compile(r"^\s*from\+(?P<txt>\w[\w|.]*)\s*import\s*(?P<fcn>[*|\w+][,\s*\w+]*)")
-        for nb in self.notebooks:
-            for cell in nb.content.cells:
-                if cell.cell_type == "code":
-                    if "nbpages" in cell.metadata.keys():
-                        for line in cell.source.strip().splitlines():
-                            m = IMPORT.match(line)
-                            if m:
-                                for lib in list(filter(None, re.split(r'[,|\s+]', m.group("txt")))):
-                                    if lib == 'as':
-                                        break
-                                    python_index[lib].append(cell.metadata["nbpages"]["link"])
-                            m = FROM.match(line)
-                            if m:
-                                for fcn in list(filter(None, re.split(r'[,|\s+]', m.group("fcn")))):
-                                    if fcn == 'as':
-                                        break
-                                    key = m.group("txt") + "." + fcn
-                                    python_index[key].append(cell.metadata["nbpages"]["link"])
-        return python_index
+        """Return deduplicated dictionary of links to cells indexed by the modules and names they import."""
+        if self._python_index is None:
+            python_index = collections.defaultdict(list)
+            for nb in self.notebooks:
+                for name, links in nb.facts["imports"].items():
+                    python_index[name].extend(link for link in links if link)
+            self._python_index = {name: list(dict.fromkeys(links)) for name, links in python_index.items()}
+        return self._python_index
 
     @property
     def tag_index(self):
         """Return dictionary of sorted list of links to cells indexed by tags."""
-        if not self._tag_index:
-            for nb in self.notebooks:
-                for tag, links in nb.tags.items():
-                    self._tag_index[tag].extend(links)
-            for tag in self._tag_index.keys():
-                self._tag_index[tag] = list(sorted(set(self._tag_index[tag]), key=natsort))
-        return self._tag_index
+        return self.tag_tree.links
+
+    @property
+    def tag_tree(self):
+        """Return the TagIndex of all notebooks, kept in the cache until a notebook or the configuration changes."""
+        if self._tag_tree is None:
+            key = None
+            if self.cache and not any(nb.modified for nb in self.notebooks):
+                signatures = [(nb.filename, os.stat(nb.path).st_mtime_ns, os.stat(nb.path).st_size)
+                              for nb in self.notebooks]
+                key = "tags|" + text_hash(json.dumps([facts_signature(), signatures]))
+                self._tag_tree = self.cache.get(self.src_dir, key)
+            if self._tag_tree is None:
+                tags = collections.defaultdict(list)
+                for nb in self.notebooks:
+                    for tag, links in nb.tags.items():
+                        tags[tag].extend(links)
+                self._tag_tree = TagIndex(tags)
+                if key:
+                    self.cache.put(self.src_dir, key, self._tag_tree)
+        return self._tag_tree
+
+    def query_tags(self, expression):
+        """Return the sorted list of links to cells satisfying a tag query such as 'author::FRB AND NOT exercise'."""
+        return self.tag_tree.query(expression)
+
+    def tag_counts(self, expression=None):
+        """Return a dictionary of the number of cells with each tag matched by the terms of a query, or all tags."""
+        return self.tag_tree.counts(expression)
 
     def get_cells(self, tag):
         """Return a new notebook created from cells with a specified tag."""
-        cells = []
-        for nb in self.notebooks:
-            cells.extend(nb.get_cells(tag))
-        nb = new_notebook(cells=cells)
-        nb["metadata"]["kernelspec"] = {"name": "python3"}
-        return nbformat.writes(nb)
+        return self.extract_cells([tag])[tag]
 
-    def insert_data_imports(self):
-        """Insert code cell to import data files required by notebooks."""
+    def extract_cells(self, tags):
+        """Return a dictionary of new notebooks created from the cells with each tag, in one pass over the notebooks."""
+        import nbformat
+        from nbformat.v4.nbbase import new_notebook
+        cells = {tag: [] for tag in tags}
         for nb in self.notebooks:
+            for tag, tagged_cells in nb.get_cells_by_tag(cells).items():
+                cells[tag].extend(tagged_cells)
+        notebooks = {}
+        for tag in cells:
+            nb = new_notebook(cells=cells[tag])
+            nb["metadata"]["kernelspec"] = {"name": "python3"}
+            notebooks[tag] = nbformat.writes(nb)
+        return notebooks
+
+    def write_cells(self, tags, out_dir="."):
+        """Write a notebook <tag>.ipynb of the cells with each tag to out_dir, returning the paths written."""
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for tag, content in self.extract_cells(tags).items():
+            path = os.path.join(out_dir, re.sub(r'[^\w.-]+', '_', tag) + ".ipynb")
+            self.report_write(path, write_if_changed(path, content + "\n"))
+            paths.append(path)
+        return paths
+
+    def execution_key(self, nb):
+        """Return a hash of the inputs to executing a notebook: its code, its kernel and the data files it imports."""
+        code = [cell.source for cell in nb.content.cells if cell.cell_type == "code"]
+        data = [(path, file_hash(os.path.join(self.src_dir, path))) for path, url in nb.data_import_links]
+        return text_hash(json.dumps([kernel_name(nb.content), code, data]))
+
+    def execute_notebooks(self, notebooks=None):
+        """Replace the outputs of code cells with cached or new outputs of executing the notebooks, if enabled."""
+        if not self.execute:
+            return
+        notebooks = self.notebooks if notebooks is None else notebooks
+        cache = self.cache if self.cache else ParseCache(max_bytes=int(config.get("cache_max_mb", CACHE_MAX_MB)) * 2**20)
+        with self.timings.stage("execute"):
+            args = []
+            pending = []
+            for nb in notebooks:
+                key = f"execute|{self.execution_key(nb)}"
+                results = cache.get_key(key)
+                if results is None:
+                    args.append((nb.content, kernel_name(nb.content), self.timeout, os.path.abspath(self.src_dir)))
+                    pending.append((nb, key))
+                else:
+                    log.debug("- %s outputs are up to date", nb.filename,
+                              extra={"action": "up to date", "notebook": nb.filename})
+                    nb.set_outputs(results)
+            names = [nb.filename for nb, key in pending]
+            for (nb, key), (results, error) in zip(pending, self.map(execute_notebook, args, names)):
+                if error:
+                    log.warning("- executing %s failed: %s", nb.filename, error,
+                                extra={"action": "failed", "notebook": nb.filename})
+                    continue
+                log.info("- executed %s", nb.filename, extra={"action": "executed", "notebook": nb.filename})
+                cache.put_key(key, results)
+                nb.set_outputs(results)
+
+    def insert_data_imports(self, notebooks=None):
+        """Insert code cell to import data files required by notebooks, or by a subset of the notebooks."""
+        from nbformat.v4.nbbase import new_code_cell
+        for nb in self.notebooks if notebooks is None else notebooks:
             if nb.data_import_links:
                 import_cell = None
                 for cell in nb.content.cells:
                     if cell.cell_type == "code" and cell.source.startswith(DATA_IMPORT_TAG):
-                        print(f"- amending data import for {nb.filename}")
+                        log.info("- amending data import for %s", nb.filename,
+                                 extra={"action": "amending data import", "notebook": nb.filename})
                         import_cell = cell
                         break
                 if import_cell is None:
-                    print(f"- inserting data import for {nb.filename}")
-                    nb.content.cells.insert(2, new_code_cell())
+                    log.info("- inserting data import for %s", nb.filename,
+                             extra={"action": "inserting data import", "notebook": nb.filename})
+                    nb.content.cells.insert(2, nb.stable_id(new_code_cell(), "nbpages-data-import"))
                     import_cell = nb.content.cells[2]
                 content = f"{DATA_IMPORT_TAG}" "\n"
                 content += "import os,  requests\n\n"
@@ -437,24 +1273,28 @@ for filepath, fileurl in file_links:
             f.write(response.content)
 """
                 import_cell.source = content
-
-    def insert_headers(self):
-        env = Environment(loader=FileSystemLoader(config["templates_dir"]))
-        template = env.get_template('notebook_header.tpl')
-        source = NOTEBOOK_HEADER_TAG + template.render(page_title=config["github_repo_name"],
+                nb.invalidate()
+
+    def insert_headers(self, notebooks=None):
+        """Insert headers in all notebooks, or in a subset of the notebooks."""
+        from nbformat.v4.nbbase import new_markdown_cell
+        from .nbtemplates import render_template
+        source = NOTEBOOK_HEADER_TAG + render_template(config["templates_dir"], 'notebook_header.tpl', self.bytecode_dir,
+                                                       page_title=config["github_repo_name"],
                                                        page_url=config["github_pages_url"],
                                                        github_url=config["github_repo_url"])
-        for nb in self.notebooks:
-            """Insert header to notebook contents."""
+        for nb in self.notebooks if notebooks is None else notebooks:
             if nb.content.cells[0].source.startswith(NOTEBOOK_HEADER_TAG):
-                print('- amending header for {0}'.format(nb.filename))
+                log.info("- amending header for %s", nb.filename, extra={"action": "amending header", "notebook": nb.filename})
                 nb.content.cells[0].source = source
             else:
-                print('- inserting header for {0}'.format(nb.filename))
-                nb.content.cells.insert(0, new_markdown_cell(source))
+                log.info("- inserting header for %s", nb.filename, extra={"action": "inserting header", "notebook": nb.filename})
+                nb.content.cells.insert(0, nb.stable_id(new_markdown_cell(source), "nbpages-header"))
+            nb.invalidate()
 
-    def insert_navbars(self):
-        """Insert navigation bars."""
+    def insert_navbars(self, notebooks=None):
+        """Insert navigation bars in all notebooks, or in a subset of the notebooks."""
+        from nbformat.v4.nbbase import new_markdown_cell
 
         # colab opens from github repository
         COLAB_LINK = f'<p><a href="https://colab.research.google.com/github/{config["github_user_name"]}/{config["github_repo_name"]}' + \
@@ -467,102 +1307,329 @@ for filepath, fileurl in file_links:
                         '/{notebook_filename}"> <img align="left" src="https://img.shields.io/badge/Github-Download-blue.svg"' + \
                         ' alt="Download" title="Download Notebook"></a>'
 
+        tagged = self.shard_tagged if self.shard_tagged is not None else bool(self.tag_index)
         a, b, c = itertools.tee(self.notebooks, 3)
         try:
             next(c)
         except StopIteration:
             return
         for prev_nb, nb, next_nb in zip(itertools.chain([None], a), b, itertools.chain(c, [None])):
+            if notebooks is not None and nb not in notebooks:
+                continue
             navbar = NAVBAR_TAG
             navbar += f"< [{prev_nb.title}]({prev_nb.html_url}) " if prev_nb else ""
             navbar += f"| [Contents](toc.html) |"
-            navbar += f" [Tag Index](tag_index.html) |" if self.tag_index else ""
+            navbar += f" [Tag Index](tag_index.html) |" if tagged else ""
             navbar += f" [{next_nb.title}]({next_nb.html_url}) >" if next_nb else ""
             navbar += COLAB_LINK.format(dst=self.dst_dir, notebook_filename=nb.filename)
             navbar += DOWNLOAD_LINK.format(notebook_filename=nb.filename)
             if nb.content.cells[1].source.startswith(NAVBAR_TAG):
-                print(f"- amending navbar for {nb.filename}")
+                log.info("- amending navbar for %s", nb.filename, extra={"action": "amending navbar", "notebook": nb.filename})
                 nb.content.cells[1].source = navbar
             else:
-                print(f"- inserting navbar for {nb.filename}")
-                nb.content.cells.insert(1, new_markdown_cell(source=navbar))
+                log.info("- inserting navbar for %s", nb.filename, extra={"action": "inserting navbar", "notebook": nb.filename})
+                nb.content.cells.insert(1, nb.stable_id(new_markdown_cell(source=navbar), "nbpages-navbar-top"))
             if nb.content.cells[-1].source.startswith(NAVBAR_TAG):
-                print(f"- amending navbar for {nb.filename}")
+                log.info("- amending navbar for %s", nb.filename, extra={"action": "amending navbar", "notebook": nb.filename})
                 nb.content.cells[-1].source = navbar
             else:
-                print(f"- inserting navbar for {nb.filename}")
-                nb.content.cells.append(new_markdown_cell(source=navbar))
+                log.info("- inserting navbar for %s", nb.filename, extra={"action": "inserting navbar", "notebook": nb.filename})
+                nb.content.cells.append(nb.stable_id(new_markdown_cell(source=navbar), "nbpages-navbar-bottom"))
+            nb.invalidate()
 
     def insert_subsection_numbers(self):
         for nb in self.notebooks:
-            nb.insert_subsection_numbers()
+            if not nb.numbered:
+                nb.insert_subsection_numbers()
+
+    def load(self):
+        """Read all notebooks."""
+        for nb in self.notebooks:
+            with self.timings.notebook(nb.filename):
+                nb.content
 
     def lint(self):
         """Report style issues."""
         for nb in self.notebooks:
             nb.lint()
-        for data in sorted(list(self.get_files(config["data_subdir"], ['.csv', '.txt'])), key=str.casefold):
-            regex = re.compile(data)
-            found = False
-            for nb in self.notebooks:
-                for cell in nb.content.cells:
-                    found = regex.search(cell.source)
-                    if found:
-                        break
-                if found:
-                    break
-            if not found:
-                print(f"    Data file not used in any notebook: {data}")
-        for figure in sorted(list(self.get_files(config["figures_subdir"], ['.png', '.jpg'])), key=str.casefold):
-            regex = re.compile(figure)
-            found = False
-            for nb in self.notebooks:
-                for cell in nb.content.cells:
-                    found = regex.search(cell.source)
-                    if found:
-                        break
-                if found:
-                    break
-            if not found:
-                print(f"    Figure not used in any notebook: {figure}")
+        for data in self.unused_files("data", self.get_files(config["data_subdir"], DATA_SUFFIXES)):
+            print(f"    Data file not used in any notebook: {data}")
+        for figure in self.unused_files("figures", self.get_files(config["figures_subdir"], FIGURE_SUFFIXES)):
+            print(f"    Figure not used in any notebook: {figure}")
 
     def metadata(self):
         """Print metadata."""
         for nb in self.notebooks:
             print(f"\n{nb.filename}")
-            print(json.dumps(nb.content['metadata'], sort_keys=True, indent=4))
+            print(json.dumps(nb.metadata, sort_keys=True, indent=4))
+
+    def publish(self):
+        """Run the publish stages, recording the time of each stage."""
+        self.run_stages(PUBLISH_STAGES)
+
+    def variant(self, dst_dir, remove_cells=(), remove_code=False, numbered=None):
+        """Return a collection publishing copies of these notebooks to dst_dir, with cells and code removed.
+
+        numbered is an optional dictionary of pickled numbered content, indexed by notebook filename. Notebooks left
+        unchanged by the removals are given the numbered content, and the others are numbered when published.
+        """
+        notebooks = NbCollection(self.src_dir, dst_dir, force=self.force, jobs=self.jobs, cache=bool(self.cache),
+                                 timings=self.timings, search_json=self.search_json,
+                                 extract_images=self.extract_images, compress=self.compress)
+        notebooks.executor = self.executor
+        for nb, base in zip(notebooks.notebooks, self.notebooks):
+            nb._source_hash = base.source_hash
+            nb._content = pickle.loads(pickle.dumps(base.content, pickle.HIGHEST_PROTOCOL))
+            if remove_cells:
+                nb.remove_cells(*remove_cells)
+            if remove_code:
+                nb.remove_code()
+            if not nb.modified and numbered:
+                nb._content = pickle.loads(numbered[nb.filename])
+                nb.numbered = True
+                nb.modified = True
+        return notebooks
+
+    def publish_variants(self, names=None):
+        """Publish the variants defined in nbpages.cfg, or the named variants, reading the notebooks once.
+
+        Each variant is published to its own dst_dir, removing the cells tagged with any of its remove_cells and, if
+        remove_code is set, solution code and hidden tests. Notebooks are read and numbered once for all variants,
+        and with jobs > 1 one pool of worker processes renders the pages of every variant.
+        """
+        names = names if names else list(variants)
+        for name in names:
+            assert name in variants, f"variant '{name}' not found in nbpages.cfg"
+            assert os.path.exists(variants[name]["dst_dir"]), \
+                f"destination directory '{variants[name]['dst_dir']}' of variant '{name}' not found"
+        with self.timings.stage("load"):
+            self.load()
+        with self.timings.stage("insert_subsection_numbers"):
+            notebooks = self.variant(self.dst_dir)
+            notebooks.insert_subsection_numbers()
+            numbered = {nb.filename: pickle.dumps(nb.content, pickle.HIGHEST_PROTOCOL) for nb in notebooks.notebooks}
+        with self.process_pool():
+            for name in names:
+                spec = variants[name]
+                log.info("- publishing variant %s to %s", name, spec["dst_dir"],
+                         extra={"action": "publishing", "path": spec["dst_dir"]})
+                notebooks = self.variant(spec["dst_dir"], spec.get("remove_cells", "").split(),
+                                         spec.getboolean("remove_code", False), numbered)
+                notebooks.publish()
+
+    def shard(self, index, count):
+        """Return the notebooks of shard index of count, numbered from 1, as contiguous blocks of nearly equal size."""
+        assert 1 <= index <= count, f"shard {index}/{count} does not exist"
+        n = len(self.notebooks)
+        return self.notebooks[(index - 1) * n // count:index * n // count]
+
+    def publish_shard(self, index, count, prepare=None):
+        """Write the notebooks of one shard, read with prepare applied, and its partial index for merge_shards."""
+        shard = self.shard(index, count)
+        self.written = []
+        self.unchanged = []
+        self.execute_notebooks(shard)
+
+        def load(nb):
+            with self.timings.notebook(nb.filename):
+                if prepare:
+                    prepare(nb)
+                nb.insert_subsection_numbers()
+                return bool(nb.tags)
+
+        def has_tags_key(nb):
+            with open(nb.path, 'rb') as f:
+                return b'"tags"' in f.read()
+
+        with self.timings.stage("load"):
+            k = self.notebooks.index(shard[0]) if shard else 0
+            nearby = self.notebooks[max(0, k - 1):k + len(shard) + 1] if shard else []
+            tagged = [load(nb) for nb in nearby]
+            others = (nb for nb in self.notebooks if nb not in nearby and has_tags_key(nb))
+            self.shard_tagged = any(tagged) or any(load(nb) for nb in others)
+            for nb in self.notebooks:
+                if nb not in shard:
+                    nb._content = None
+        for stage in ["insert_headers", "insert_navbars", "insert_data_imports", "write_ipynb", "write_html"]:
+            with self.timings.stage(stage):
+                getattr(self, stage)(shard)
+        with self.timings.stage("write_shard"):
+            partial = {"version": MANIFEST_VERSION, "shard": [index, count],
+                       "notebooks": {nb.filename: self.build_key(nb) for nb in shard},
+                       "images": {nb.filename: self.images[nb.filename] for nb in shard if self.images.get(nb.filename)},
+                       "facts": {nb.filename: nb.facts for nb in shard}}
+            if self.search_json:
+                partial["sections"] = {nb.filename: [(os.stat(nb.path).st_mtime_ns, os.stat(nb.path).st_size),
+                                                     self.section_texts(nb)] for nb in shard}
+            path = os.path.join(self.dst_dir, SHARD_FILE.format(index=index, count=count))
+            self.report_write(path, write_if_changed(path, json.dumps(partial)))
+        self.report_summary()
+
+    def merge_shards(self):
+        """Write the index pages, assets and manifest from the partial indexes of the shards, without the notebooks."""
+        paths = sorted(glob.glob(os.path.join(self.dst_dir, SHARD_PATTERN)))
+        assert paths, f"no shards found in {self.dst_dir}"
+        partials = []
+        for path in paths:
+            with open(path) as f:
+                partials.append(json.load(f))
+        count = partials[0]["shard"][1]
+        assert sorted(tuple(p["shard"]) for p in partials) == [(k, count) for k in range(1, count + 1)], \
+            f"shards in {self.dst_dir} are not a complete set of {count} shards"
+        assert all(p["version"] == MANIFEST_VERSION for p in partials), "shards written by another version of nbpages"
+        facts = {}
+        for p in partials:
+            facts.update(p["facts"])
+            self._build_keys.update(p["notebooks"])
+        missing = [nb.filename for nb in self.notebooks if nb.filename not in facts]
+        assert not missing, f"notebooks not published by any shard: {', '.join(missing)}"
+        for nb in self.notebooks:
+            nb._facts = facts[nb.filename]
+            nb.numbered = True
+            nb.modified = True
+        self._images = {f: images for p in partials for f, images in p["images"].items()}
+        if self.search_json:
+            self.shard_sections = {f: sections for p in partials for f, sections in p["sections"].items()}
+        self.remove_unused_images()
+        self.run_stages(MERGE_STAGES)
+        for path in paths:
+            os.remove(path)
+
+    def run_stages(self, stages):
+        """Run publish stages in order, recording the time of each stage and reporting the files written."""
+        self.written = []
+        self.unchanged = []
+        for stage in PUBLISH_STAGES:
+            if stage in stages:
+                with self.timings.stage(stage):
+                    getattr(self, stage)()
+        self.report_summary()
+
+    def report_summary(self):
+        """Log the number of files written and left unchanged."""
+        log.info("- %d files written, %d unchanged", len(self.written), len(self.unchanged),
+                 extra={"action": "summary"})
+
+    def report_write(self, path, written, notebook=None):
+        """Log and count a file that was written, or left in place because it is up to date."""
+        if written:
+            self.written.append(path)
+            log.info("- writing %s", path, extra={"action": "writing", "notebook": notebook, "path": path})
+        else:
+            self.unchanged.append(path)
+            log.debug("- %s is up to date", path, extra={"action": "up to date", "notebook": notebook, "path": path})
 
-    def remove_cells(self, tag):
+    def remove_cells(self, *tags):
+        """Remove cells with any of the specified tags from all notebooks."""
         for nb in self.notebooks:
-            nb.remove_cells(tag)
+            nb.remove_cells(*tags)
 
     def remove_code(self):
         for nb in self.notebooks:
-            nb.replace_code(SOLUTION_CODE, "# YOUR SOLUTION HERE")
-            nb.replace_code(HIDDEN_TESTS, "")
-
-    def search(self, pattern):
-        regex = re.compile(pattern)
+            nb.remove_code()
+
+    def search(self, pattern, outputs=False, count=False, as_json=False):
+        """Print notebooks with cells matching a regular expression, scanning the notebook files in parallel.
+
+        By default the first match in each notebook is shown. With count, all matches are counted.
+        """
+        re.compile(pattern)   # report errors in the pattern before scanning any files
+        results = self.map(search_file, [(nb.path, pattern, outputs, not count) for nb in self.notebooks],
+                           [nb.filename for nb in self.notebooks])
+        for nb, matches in zip(self.notebooks, results):
+            if not matches:
+                continue
+            if as_json:
+                print(json.dumps({"file": nb.filename, "count": len(matches), "matches": matches}))
+            elif count:
+                print(f"{nb.filename}: {len(matches)}")
+            else:
+                print(nb.filename)
+                for m in matches:
+                    print(f"    cell {m['cell']}, line {m['line']}: {m['context']}")
+
+    def section_texts(self, nb):
+        """Return a list of (link, text) for the sections of a notebook file, excluding cells inserted by nbpages.
+
+        The notebook file is read afresh, so the result does not depend on changes made to the notebook in memory.
+        """
+        chapter, section, _ = NB_FILENAME.match(nb.filename).groups()
+        source = type(nb)(nb.filename, chapter, section)
+        source.cache = nb.cache
+        texts = {}
+        for cell, link in source.cell_links():
+            if source.is_markdown(cell) or cell.cell_type == "code" and not cell.source.startswith(DATA_IMPORT_TAG):
+                texts.setdefault(source.link if link.startswith("[]") else link, []).append(cell.source)
+        return [(link, "\n".join(text)) for link, text in texts.items()]
+
+    def search_index(self, path=SEARCH_INDEX_FILE, sections=None):
+        """Return the full text search index of all notebooks, updating the index saved at path for changed notebooks.
+
+        sections is an optional dictionary of the (signature, section texts) of each notebook recorded by the shards
+        of a sharded publish, used instead of reading the notebook files.
+        """
+        index = SearchIndex.load(path, text_hash(json.dumps(dict(config), sort_keys=True)))
+        changed = False
+        filenames = {nb.filename for nb in self.notebooks}
+        for filename in set(index.files) - filenames:
+            index.remove(filename)
+            changed = True
         for nb in self.notebooks:
-            for cell in nb.content.cells:
-                if regex.search(cell.source):
-                    print(nb.filename)
-                    break
-
-    def remove(self, pattern):
-        assert self.dst_dir != self.src_dir, "destination directory must be different from source directory"
+            if sections:
+                signature = tuple(sections[nb.filename][0])
+            else:
+                st = os.stat(nb.path)
+                signature = (st.st_mtime_ns, st.st_size)
+            if index.files.get(nb.filename, (None,))[0] != signature:
+                log.debug("- indexing %s", nb.filename, extra={"action": "indexing", "notebook": nb.filename})
+                texts = [tuple(text) for text in sections[nb.filename][1]] if sections else self.section_texts(nb)
+                index.add(nb.filename, signature, texts)
+                changed = True
+        if changed:
+            index.save(path)
+        return index
 
-        html_files = glob.glob(os.path.join(self.dst_dir, pattern))
-        for f in html_files:
-            print(f"- removing {f}")
-            os.remove(f)
+    def find(self, query, limit=20, as_json=False):
+        """Print the sections best matching a full text query, ranked by relevance."""
+        results = self.search_index().search(query, limit)
+        if as_json:
+            print(json.dumps(results))
+        else:
+            for r in results:
+                print(f"{r['score']:8.3f}  {r['link']}")
+
+    def remove_orphans(self):
+        """Remove html and ipynb files in the destination directory that are not outputs of this collection."""
+        outputs = {nb.filename for nb in self.notebooks}
+        outputs.update(os.path.splitext(nb.filename)[0] + ".html" for nb in self.notebooks)
+        outputs.update(f"{stem}.html" for stem in INDEX_PAGES)
+        for pattern in ["*.html", "*.ipynb"]:
+            for f in glob.glob(os.path.join(self.dst_dir, pattern)):
+                if os.path.basename(f) not in outputs:
+                    log.info("- removing %s", f, extra={"action": "removing", "path": f})
+                    os.remove(f)
+
+    def sync_assets(self, sub_dir, names):
+        """Copy new and changed files of a notebooks subdirectory to the destination, and remove files no longer used."""
+        src_dir = os.path.join(self.src_dir, sub_dir)
+        dst_dir = os.path.join(self.dst_dir, sub_dir)
+        # compressed siblings of the files are kept, and removed by write_compressed when out of date
+        siblings = {name + suffix for name in names for suffix in (GZIP_SUFFIX, BROTLI_SUFFIX)}
+        copied, unchanged, removed = sync_files(src_dir, dst_dir, names, siblings)
+        for name in copied:
+            log.info("- copying %s to %s", os.path.join(src_dir, name), os.path.join(dst_dir, name),
+                     extra={"action": "copying", "path": os.path.join(dst_dir, name)})
+        for name in removed:
+            log.info("- removing %s", os.path.join(dst_dir, name),
+                     extra={"action": "removing", "path": os.path.join(dst_dir, name)})
+        self.written.extend(os.path.join(dst_dir, name) for name in copied)
+        self.unchanged.extend(os.path.join(dst_dir, name) for name in unchanged)
 
     def write_data_index(self):
         """Write data_index.html and copy data files to destination directory."""
         content = ""
-        self.remove(os.path.join(config["data_subdir"], "*"))
+        data_files = []
         if self.data_index:
-            print("- writing data index")
             content += f"# [{config['github_repo_name']}]({config['github_pages_url']})\n"
             content += "\n## Index of Data files in this Repository\n"
             for data, links in sorted(self.data_index.items(), key=lambda x: natsort(x[0])):
@@ -571,17 +1638,14 @@ for filepath, fileurl in file_links:
                     content += f"![{data}]({config['data_subdir']}/{data})\n"
                     for link in links:
                         content += f"* {link}\n"
-                    data_src = os.path.join(self.src_dir, config["data_subdir"], data)
-                    data_dst = os.path.join(self.dst_dir, config["data_subdir"], data)
-                    print(f"- copying {data_src} to {data_dst}")
-                    shutil.copy(data_src, data_dst)
+                    data_files.append(data)
+        self.sync_assets(config["data_subdir"], data_files)
         self.write_md2html("data_index", content)
 
     def write_figure_index(self):
         content = ""
-        self.remove(os.path.join(config["figures_subdir"], "*"))
+        figure_files = []
         if self.figure_index:
-            print("- writing figure index")
             content += f"# [{config['github_repo_name']}]({config['github_pages_url']})\n"
             content += "\n## Index of Figures in this Repository\n"
             for figure, links in sorted(self.figure_index.items(), key=lambda x: natsort(x[0])):
@@ -590,32 +1654,78 @@ for filepath, fileurl in file_links:
                     content += f"![{figure}]({config['figures_subdir']}/{figure})\n"
                     for link in links:
                         content += f"* {link}\n"
-                    figure_src = os.path.join(self.src_dir, config["figures_subdir"], figure)
-                    figure_dst = os.path.join(self.dst_dir, config["figures_subdir"], figure)
-                    print(f"- copying {figure_src} to {figure_dst}")
-                    shutil.copy(figure_src, figure_dst)
+                    figure_files.append(figure)
+        self.sync_assets(config["figures_subdir"], figure_files)
         self.write_md2html("figure_index", content)
 
-    def write_html(self):
-        """Create and write html files to the destination directory."""
-        html_exporter = HTMLExporter(template_file=os.path.join(config["templates_dir"], "notebook.tpl"))
-        for nb in self.notebooks:
-            (body, resources) = html_exporter.from_notebook_node(nb.content)
-            body = re.sub('{github_user_name}', config["github_user_name"], body)
-            body = re.sub('{github_repo_name}', config["github_repo_name"], body)
+    def write_html(self, notebooks=None):
+        """Create and write html files of all notebooks, or of a subset of the notebooks, to the destination directory.
+
+        With extract_images, output images are written once to the images directory and linked from the html pages.
+        When all notebooks are written, image files no longer linked from any page are removed.
+        """
+        template_file = os.path.join(config["templates_dir"], "notebook.tpl")
+        images_dir = self.images_dir if self.extract_images else None
+        if images_dir:
+            os.makedirs(images_dir, exist_ok=True)
+        args = []
+        names = []
+        for nb in self.notebooks if notebooks is None else notebooks:
             html_path = os.path.join(self.dst_dir,  os.path.splitext(nb.filename)[0] + ".html")
-            print(f"- writing {html_path}")
-            with open(html_path, 'w') as f:
-                f.write(body)
-
-    def write_ipynb(self):
-        """Write notebooks to the destination directory."""
-        for nb in self.notebooks:
-            nbformat.write(nb.content, os.path.join(self.dst_dir, nb.filename))
+            if self.is_current(nb, html_path) and self.has_images(nb):
+                self.report_write(html_path, False, nb.filename)
+                continue
+            args.append((nb.content, html_path, template_file, dict(config), self.bytecode_dir, images_dir))
+            names.append(nb.filename)
+        for name, (content, html_path, *_), (written, images) in zip(names, args, self.map(export_html, args, names)):
+            self.report_write(html_path, written, name)
+            for image in sorted(image for image in images if images[image]):
+                self.report_write(os.path.join(self.images_dir, image), True, name)
+            self.images[name] = sorted(images)
+        if notebooks is None:
+            self._images = {nb.filename: self.images[nb.filename] for nb in self.notebooks if self.images.get(nb.filename)}
+            self.remove_unused_images()
+
+    def remove_unused_images(self):
+        """Remove output image files that are not linked from any html page."""
+        if not os.path.isdir(self.images_dir):
+            return
+        used = set(itertools.chain.from_iterable(self.images.values()))
+        with os.scandir(self.images_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith(".") and entry.name not in used:
+                    log.info("- removing %s", entry.path, extra={"action": "removing", "path": entry.path})
+                    os.remove(entry.path)
+
+    def write_ipynb(self, notebooks=None):
+        """Write all notebooks, or a subset of the notebooks, to the destination directory."""
+        args = []
+        names = []
+        for nb in self.notebooks if notebooks is None else notebooks:
+            ipynb_path = os.path.join(self.dst_dir, nb.filename)
+            if self.is_current(nb, ipynb_path):
+                self.report_write(ipynb_path, False, nb.filename)
+                continue
+            args.append((nb.content, ipynb_path))
+            names.append(nb.filename)
+        for name, (content, ipynb_path), written in zip(names, args, self.map(export_ipynb, args, names)):
+            self.report_write(ipynb_path, written, name)
+
+    def write_manifest(self):
+        """Record the build keys of all published notebooks in the destination directory."""
+        manifest = {"version": MANIFEST_VERSION,
+                    "notebooks": {nb.filename: self.build_key(nb) for nb in self.notebooks}}
+        if self.images:
+            manifest["images"] = self.images
+        if self.compressed:
+            manifest["compressed"] = self.compressed
+        path = os.path.join(self.dst_dir, MANIFEST_FILE)
+        self.report_write(path, write_if_changed(path, json.dumps(manifest, sort_keys=True, indent=1)))
+        self._manifest = manifest["notebooks"]
 
     def write_index_html(self):
         """Write index.md using the index.md.tpl template."""
-        print("- writing index.md")
+        from .nbtemplates import render_template
         index_toc = [f"### [Table of Contents]({config['github_pages_url']}/toc.html)"] if self.notebooks else []
         if os.path.isfile(os.path.join(self.dst_dir, "data_index.html")):
             index_toc += [f"### [Data Index]({config['github_pages_url']}/data_index.html)"]
@@ -626,15 +1736,14 @@ for filepath, fileurl in file_links:
         if os.path.isfile(os.path.join(self.dst_dir, "tag_index.html")):
             index_toc += [f"### [Tag Index]({config['github_pages_url']}/tag_index.html)"]
         index_toc += [f"- {nb.link}" if type(nb) == Section else f"\n### {nb.link}" for nb in self.notebooks]
-        env = Environment(loader=FileSystemLoader("templates"))
-        with open(os.path.join(self.dst_dir, "index.md"), 'w') as f:
-            f.write(env.get_template('index.md.tpl').render(
-                readme_toc=index_toc, page_title=config['github_repo_name'], github_url=config['github_repo_url']))
+        path = os.path.join(self.dst_dir, "index.md")
+        content = render_template(config["templates_dir"], 'index.md.tpl', self.bytecode_dir, readme_toc=index_toc,
+                                  page_title=config['github_repo_name'], github_url=config['github_repo_url'])
+        self.report_write(path, write_if_changed(path, content))
 
     def write_python_index(self):
         content = ""
         if self.python_index:
-            print("- writing python index")
             content += f"# [{config['github_repo_name']}]({config['github_pages_url']})\n"
             content += "\n## Index of Python Libraries used in this Repository\n"
             for key in sorted(self.python_index.keys(), key=str.casefold):
@@ -648,7 +1757,6 @@ for filepath, fileurl in file_links:
         """Write tag index."""
         content = ""
         if self.tag_index:
-            print("- writing tag index file")
             content += f"# [{config['github_repo_name']}]({config['github_pages_url']})\n"
             content += "\n## Tag Index\n"
             for tag in sorted(self.tag_index.keys(), key=str.casefold):
@@ -661,7 +1769,6 @@ for filepath, fileurl in file_links:
         """Write table of contents."""
         content = ""
         if self.notebooks:
-            print("- writing table of contents file")
             content = f"# [{config['github_repo_name']}]({config['github_pages_url']})\n"
             for nb in self.notebooks:
                 content += '\n' + '\n'.join(nb.toc) + '\n'
@@ -682,15 +1789,55 @@ for filepath, fileurl in file_links:
 
         self.write_md2html("toc", content)
 
+    def write_search_json(self):
+        """Write a compact json search index of the notebook sections for client side search, if enabled."""
+        if self.search_json:
+            path = os.path.join(self.dst_dir, SEARCH_JSON_FILE)
+            self.report_write(path, write_if_changed(path, self.search_index(sections=self.shard_sections).to_json()))
+
+    def write_compressed(self):
+        """Write compressed siblings of changed published files if enabled, and remove siblings out of date."""
+        if not self.compress and not self.compressed:
+            return
+        paths = []
+        if self.compress:
+            for root, dirs, files in os.walk(self.dst_dir):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.endswith(COMPRESS_SUFFIXES) and not name.startswith("."))
+        kept = []
+        for sibling in [os.path.join(self.dst_dir, name) for name in self.compressed]:
+            path, suffix = os.path.splitext(sibling)
+            if suffix not in (GZIP_SUFFIX, BROTLI_SUFFIX) or not path.endswith(COMPRESS_SUFFIXES):
+                continue
+            if self.compress and path in paths:
+                continue
+            if is_current_sibling(path, sibling):
+                kept.append(sibling)
+            elif os.path.isfile(sibling):
+                log.info("- removing %s", sibling, extra={"action": "removing", "path": sibling})
+                os.remove(sibling)
+        if self.compress:
+            saved = collections.Counter()
+            for sibling, written, size in compress_files(paths):
+                self.report_write(sibling, written)
+                saved[os.path.splitext(sibling)[1]] += size
+                kept.append(sibling)
+            for suffix, size in sorted(saved.items()):
+                log.info("- %s siblings of %d files save %d bytes", suffix, len(paths), size,
+                         extra={"action": "compressed"})
+        self._compressed = sorted(os.path.relpath(sibling, self.dst_dir) for sibling in kept)
+
     def write_md2html(self, stem, content):
-        dir_stem = os.path.join(self.dst_dir, stem)
+        """Render markdown content to an html page in the destination directory."""
+        from nbformat.v4.nbbase import new_markdown_cell, new_notebook
+        from .nbtemplates import html_exporter
+        html_path = os.path.join(self.dst_dir, f"{stem}.html")
         if content:
-            with open(f"{dir_stem}.md", 'w') as f:
-                f.write(content)
-            os.system(f"notedown {dir_stem}.md > {dir_stem}.ipynb")
-            os.system(f"jupyter nbconvert --to html {dir_stem}.ipynb")
-            os.remove(f"{dir_stem}.md")
+            nb = new_notebook(cells=[new_markdown_cell(content, id=stem)])
+            (body, resources) = html_exporter(bytecode_dir=self.bytecode_dir).from_notebook_node(nb, resources={"metadata": {"name": stem}})
+            self.report_write(html_path, write_if_changed(html_path, body))
         else:
             # if no content, remove old file
-            if os.path.isfile(f"{dir_stem}.html"):
-                os.remove(f"{dir_stem}.html")
+            if os.path.isfile(html_path):
+                os.remove(html_path)
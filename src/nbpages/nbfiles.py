@@ -0,0 +1,181 @@
+import itertools
+import os
+import tempfile
+
+
+def create_temp(directory, filename):
+    """Create a new hidden temporary file for filename in directory, with the permissions open() gives new files.
+
+    The permissions are set by the operating system from the umask. Return (file descriptor, path).
+    """
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        tmp = os.path.join(directory or ".", f".{filename}.{os.urandom(4).hex()}.tmp")
+        try:
+            return os.open(tmp, flags, 0o666), tmp
+        except FileExistsError:
+            continue
+
+
+def write_if_changed(path, data):
+    """Write text or bytes to path unless the file already has the same content. Return True if written.
+
+    The file is replaced atomically by writing a temporary file in the same directory and renaming it, so
+    readers never see a partly written file. Unchanged files keep their modification time.
+    """
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        mode = None
+    else:
+        mode = st.st_mode & 0o777
+        if st.st_size == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    fd, tmp = create_temp(*os.path.split(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return True
+
+
+# threads copying files, which spend most of their time waiting on the file system
+COPY_THREADS = 8
+
+# ioctl cloning a file on copy-on-write file systems such as btrfs and xfs (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file, read in blocks."""
+    import hashlib
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_copy(src, dst):
+    """Return True if dst has the same content as src, comparing contents only when sizes match but mtimes differ."""
+    try:
+        s, d = os.stat(src), os.stat(dst)
+    except FileNotFoundError:
+        return False
+    if s.st_size != d.st_size:
+        return False
+    return s.st_mtime_ns == d.st_mtime_ns or file_digest(src) == file_digest(dst)
+
+
+def copy_file(src, dst):
+    """Copy src to dst atomically with its modification time, cloning the data where the file system supports it."""
+    import shutil
+    directory, filename = os.path.split(dst)
+    fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix=f".{filename}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f, open(src, 'rb') as g:
+            try:
+                import fcntl
+                fcntl.ioctl(f.fileno(), FICLONE, g.fileno())
+            except (ImportError, OSError):
+                shutil.copyfileobj(g, f, 2**20)
+        shutil.copystat(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def sync_files(src_dir, dst_dir, names, keep=()):
+    """Make the visible files of dst_dir copies of the named files in src_dir.
+
+    Files are copied concurrently, and only if missing or changed. Files in dst_dir that are neither named nor in
+    keep are removed, leaving hidden files and subdirectories in place. Return lists of the names copied, unchanged
+    and removed.
+    """
+    import concurrent.futures
+    os.makedirs(dst_dir, exist_ok=True)
+    names = set(names)
+    copied = sorted(name for name in names if not is_copy(os.path.join(src_dir, name), os.path.join(dst_dir, name)))
+    if copied:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(COPY_THREADS, len(copied))) as executor:
+            list(executor.map(copy_file, [os.path.join(src_dir, name) for name in copied],
+                              [os.path.join(dst_dir, name) for name in copied]))
+    removed = []
+    with os.scandir(dst_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith(".") and entry.name not in names \
+                    and entry.name not in keep:
+                os.remove(entry.path)
+                removed.append(entry.name)
+    unchanged = sorted(names.difference(copied))
+    return copied, unchanged, sorted(removed)
+
+
+# suffixes of precompressed siblings, served by static web servers in place of the original file
+GZIP_SUFFIX = ".gz"
+BROTLI_SUFFIX = ".br"
+
+
+def compressors():
+    """Return a dictionary of functions compressing bytes, indexed by sibling suffix. Brotli is used if installed."""
+    import gzip
+    found = {GZIP_SUFFIX: lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+        found[BROTLI_SUFFIX] = lambda data: brotli.compress(data, quality=11)
+    return found
+
+
+def is_current_sibling(path, sibling):
+    """Return True if sibling was written from the current contents of path, as recorded by its modification time."""
+    try:
+        return os.stat(sibling).st_mtime_ns == os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def compress_file(path, compress):
+    """Write the compressed siblings of a file unless they are current. compress is a dictionary from compressors().
+
+    Siblings are given the modification time of the file. Return a list of (sibling, written, bytes saved) tuples.
+    """
+    st = os.stat(path)
+    results = []
+    data = None
+    for suffix, func in compress.items():
+        sibling = path + suffix
+        if is_current_sibling(path, sibling):
+            results.append((sibling, False, st.st_size - os.path.getsize(sibling)))
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        compressed = func(data)
+        write_if_changed(sibling, compressed)
+        os.utime(sibling, ns=(st.st_atime_ns, st.st_mtime_ns))
+        results.append((sibling, True, len(data) - len(compressed)))
+    return results
+
+
+def compress_files(paths):
+    """Write compressed siblings of files concurrently. Return a list of (sibling, written, bytes saved) tuples."""
+    import concurrent.futures
+    compress = compressors()
+    paths = list(paths)
+    if not paths:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(COPY_THREADS, len(paths))) as executor:
+        return list(itertools.chain.from_iterable(executor.map(compress_file, paths, [compress] * len(paths))))
@@ -0,0 +1,41 @@
+import json
+import logging
+import sys
+
+# attributes of structured events, passed to logging calls with the extra argument
+EVENT_FIELDS = ("action", "stage", "notebook", "path", "duration")
+
+# console log levels for --quiet, the default, and --verbose
+LEVELS = {-1: logging.WARNING, 0: logging.INFO, 1: logging.DEBUG}
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as json objects, one per line, including any event attributes."""
+
+    def format(self, record):
+        event = {"time": record.created, "level": record.levelname.lower(), "message": record.getMessage()}
+        event.update({k: getattr(record, k) for k in EVENT_FIELDS if hasattr(record, k)})
+        return json.dumps(event)
+
+
+def setup_logging(verbosity=0, json_path=None):
+    """Configure the nbpages logger to write progress messages to stderr.
+
+    verbosity is -1 for warnings only, 0 for progress messages, and 1 or more for debugging detail. If json_path
+    is given, every event is also written as json lines to that file, or to stderr if json_path is '-'.
+    """
+    logger = logging.getLogger("nbpages")
+    logger.handlers.clear()
+    logger.propagate = False
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    console.setLevel(LEVELS[max(-1, min(1, verbosity))])
+    logger.addHandler(console)
+    logger.setLevel(console.level)
+    if json_path:
+        handler = logging.StreamHandler(sys.stderr) if json_path == "-" else logging.FileHandler(json_path, mode="w")
+        handler.setFormatter(JsonFormatter())
+        handler.setLevel(logging.DEBUG)
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+    return logger
@@ -0,0 +1,220 @@
+import collections
+import heapq
+import json
+import math
+import os
+import re
+
+# number of characters shown on either side of a match
+CONTEXT = 40
+
+# a markdown link to a section, [title](url)
+MARKDOWN_LINK = re.compile(r"^\[(.*)\]\((.*)\)$", re.DOTALL)
+
+
+def drop_outputs(pairs):
+    """json object_pairs_hook discarding cell outputs and attachments as soon as each cell is parsed."""
+    return {k: v for k, v in pairs if k not in ("outputs", "attachments")}
+
+
+# the start of a notebook file written with the cells first, as nbformat does, and the separators between cells
+CELLS_START = re.compile(r'\s*\{\s*"cells"\s*:\s*\[')
+CELLS_SEPARATOR = re.compile(r'[\s,]*')
+
+# characters read at a time when scanning the cells of a notebook file
+SCAN_CHUNK = 2**16
+
+
+def iter_cells(f, object_pairs_hook=None, chunk_size=SCAN_CHUNK):
+    """Iterate over the cells of a notebook file in raw json, reading and parsing one cell at a time.
+
+    Files that do not start with the cells, such as nbformat 3 notebooks, are parsed in full.
+    """
+    decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+    buffer = f.read(chunk_size)
+    m = CELLS_START.match(buffer)
+    if not m:
+        nb = decoder.decode(buffer + f.read())
+        yield from nb.get("cells") or [cell for ws in nb.get("worksheets", []) for cell in ws.get("cells", [])]
+        return
+    pos = m.end()
+    while True:
+        pos = CELLS_SEPARATOR.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        try:
+            cell, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # a cell continuing past the end of the buffer, which grows to keep the cost linear in the cell size
+            more = f.read(max(chunk_size, len(buffer) - pos))
+            if not more:
+                raise
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+        yield cell
+        if len(buffer) - pos < chunk_size:
+            buffer = buffer[pos:] + f.read(chunk_size)
+            pos = 0
+
+
+def cell_texts(cell, outputs=False):
+    """Iterate over the source and, optionally, the text outputs of a cell in raw notebook json."""
+    source = cell.get("source", cell.get("input", ""))
+    yield "".join(source) if isinstance(source, list) else source
+    if outputs:
+        for output in cell.get("outputs", []):
+            for text in [output.get("text")] + [output.get("data", {}).get(mime) for mime in ("text/plain", "text/markdown")]:
+                if text:
+                    yield "".join(text) if isinstance(text, list) else text
+
+
+def search_file(path, pattern, outputs=False, first=True):
+    """Return a list of matches of a regular expression in the cells of a notebook file.
+
+    The cells are read and parsed one at a time as plain json, without building the nbformat representation, and
+    outputs are discarded unless they are searched. Each match is a dictionary with the cell index, line number
+    within the cell, and surrounding text. If first is set, only the first match is returned, and the rest of the
+    file is not read.
+    """
+    regex = re.compile(pattern)
+    matches = []
+    with open(path, encoding="utf-8") as f:
+        for k, cell in enumerate(iter_cells(f, None if outputs else drop_outputs)):
+            for text in cell_texts(cell, outputs):
+                for m in regex.finditer(text):
+                    start = max(text.rfind("\n", 0, m.start()) + 1, m.start() - CONTEXT)
+                    end = text.find("\n", m.end())
+                    end = min(len(text) if end < 0 else end, m.end() + CONTEXT)
+                    matches.append({"cell": k, "line": text.count("\n", 0, m.start()) + 1,
+                                    "context": text[start:end].strip()})
+                    if first:
+                        return matches
+    return matches
+
+
+# words indexed for full text search, and query terms which may end with * to match words by prefix
+WORD = re.compile(r"\w+")
+QUERY_TERM = re.compile(r"(\w+)(\*?)")
+
+# BM25 ranking parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """Return the list of lower case words in text."""
+    return WORD.findall(text.lower())
+
+
+class SearchIndex:
+    """Inverted index of the words in notebook sections, with results ranked by BM25.
+
+    Each document is a section of a notebook identified by its markdown link. Documents are added and removed
+    a notebook at a time, so the index can be updated as notebooks change. signature describes the configuration
+    the links were computed with; an index loaded with a different signature is discarded.
+    """
+
+    VERSION = 1
+
+    def __init__(self, signature=None):
+        self.version = self.VERSION
+        self.signature = signature
+        self.files = {}         # notebook filename -> (file signature, list of document ids)
+        self.docs = {}          # document id -> (notebook filename, link)
+        self.terms = {}         # document id -> {word: count}
+        self.lengths = {}       # document id -> number of words
+        self.postings = {}      # word -> {document id: count}
+        self.total = 0          # number of words in all documents
+        self.next_id = 0
+
+    @classmethod
+    def load(cls, path, signature=None):
+        """Return the index saved at path, or a new index if there is none with this version and signature."""
+        import pickle
+        try:
+            with open(path, 'rb') as f:
+                index = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return cls(signature)
+        if getattr(index, "version", None) != cls.VERSION or index.signature != signature:
+            return cls(signature)
+        return index
+
+    def save(self, path):
+        """Save the index to path, replacing any previous index atomically."""
+        import pickle
+        from .nbfiles import write_if_changed
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_if_changed(path, pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def remove(self, filename):
+        """Remove the documents of a notebook."""
+        signature, ids = self.files.pop(filename, (None, []))
+        for doc in ids:
+            for word in self.terms.pop(doc):
+                del self.postings[word][doc]
+                if not self.postings[word]:
+                    del self.postings[word]
+            self.total -= self.lengths.pop(doc)
+            del self.docs[doc]
+
+    def add(self, filename, signature, sections):
+        """Replace the documents of a notebook with a list of (link, text) sections."""
+        self.remove(filename)
+        ids = []
+        for link, text in sections:
+            doc = self.next_id
+            self.next_id += 1
+            counts = collections.Counter(tokenize(text))
+            self.docs[doc] = (filename, link)
+            self.terms[doc] = dict(counts)
+            self.lengths[doc] = sum(counts.values())
+            for word, count in counts.items():
+                self.postings.setdefault(word, {})[doc] = count
+            self.total += self.lengths[doc]
+            ids.append(doc)
+        self.files[filename] = (signature, ids)
+
+    def words(self, query):
+        """Return the indexed words matching the terms of a query."""
+        words = []
+        for word, prefix in QUERY_TERM.findall(query.lower()):
+            if prefix:
+                words.extend(w for w in self.postings if w.startswith(word))
+            elif word in self.postings:
+                words.append(word)
+        return list(dict.fromkeys(words))
+
+    def search(self, query, limit=20):
+        """Return up to limit results for a query, each a dictionary of score, notebook and link, best first."""
+        if not self.docs:
+            return []
+        n = len(self.docs)
+        average = self.total / n
+        scores = collections.defaultdict(float)
+        for word in self.words(query):
+            postings = self.postings[word]
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc, count in postings.items():
+                norm = 1 - BM25_B + BM25_B * self.lengths[doc] / average
+                scores[doc] += idf * count * (BM25_K1 + 1) / (count + BM25_K1 * norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))
+        return [{"score": round(score, 3), "notebook": self.docs[doc][0], "link": self.docs[doc][1]} for doc, score in best]
+
+    def to_json(self):
+        """Return a compact json index for client side search.
+
+        docs is a list of [title, url, length] for each section, and index maps each word to a flat list of
+        alternating document numbers and counts.
+        """
+        ids = sorted(self.docs)
+        number = {doc: k for k, doc in enumerate(ids)}
+        docs = []
+        for doc in ids:
+            m = MARKDOWN_LINK.match(self.docs[doc][1])
+            title, url = m.groups() if m else (self.docs[doc][1], "")
+            docs.append([title, url, self.lengths[doc]])
+        index = {word: [v for doc, count in sorted(postings.items()) for v in (number[doc], count)]
+                 for word, postings in sorted(self.postings.items())}
+        return json.dumps({"version": self.VERSION, "docs": docs, "index": index}, separators=(",", ":"))
@@ -0,0 +1,63 @@
+import os
+import re
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+# placeholders written by earlier versions of nbpages --setup, compiled as template variables of the same name
+LEGACY_PLACEHOLDER = re.compile(r"(?<!\{)\{(github_user_name|github_repo_name)\}(?!\})")
+
+# environments and exporters are created once in each process and reused for every page rendered
+_environments = {}
+_html_exporters = {}
+
+
+class TemplateLoader(FileSystemLoader):
+    """Load templates from directories, rewriting legacy placeholders as template variables."""
+
+    def get_source(self, environment, template):
+        source, filename, uptodate = super().get_source(environment, template)
+        return LEGACY_PLACEHOLDER.sub(r"{{ \1 }}", source), filename, uptodate
+
+
+def bytecode_cache(bytecode_dir):
+    """Return a cache of compiled templates in bytecode_dir, or None if bytecode_dir is None."""
+    if bytecode_dir is None:
+        return None
+    os.makedirs(bytecode_dir, exist_ok=True)
+    return FileSystemBytecodeCache(bytecode_dir)
+
+
+def jinja_environment(templates_dir, bytecode_dir=None):
+    """Return the Jinja environment for a templates directory, compiling each template once per process."""
+    key = (os.path.abspath(templates_dir), bytecode_dir)
+    if key not in _environments:
+        _environments[key] = Environment(loader=TemplateLoader(templates_dir), bytecode_cache=bytecode_cache(bytecode_dir))
+    return _environments[key]
+
+
+def render_template(templates_dir, name, bytecode_dir=None, **variables):
+    """Render a template from a templates directory with the given variables."""
+    return jinja_environment(templates_dir, bytecode_dir).get_template(name).render(**variables)
+
+
+def html_exporter(template_file=None, bytecode_dir=None):
+    """Return an HTMLExporter for a template file, or for the default template if template_file is None.
+
+    Exporters are reused until the template file is modified. Values used by the template are set with the
+    globals of the exporter's Jinja environment rather than substituted in the rendered html.
+    """
+    from nbconvert import HTMLExporter
+    key = (None, bytecode_dir)
+    if template_file:
+        st = os.stat(template_file)
+        key = (os.path.abspath(template_file), st.st_mtime_ns, st.st_size, bytecode_dir)
+    if key not in _html_exporters:
+        if template_file:
+            template_file = os.path.abspath(template_file)
+            loader = TemplateLoader(os.path.dirname(template_file))
+            exporter = HTMLExporter(template_file=template_file, extra_loaders=[loader])
+        else:
+            exporter = HTMLExporter()
+        exporter.environment.bytecode_cache = bytecode_cache(bytecode_dir)
+        _html_exporters[key] = exporter
+    return _html_exporters[key]
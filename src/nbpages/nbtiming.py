@@ -0,0 +1,113 @@
+import contextlib
+import json
+import logging
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+def maxrss_mb(children=False):
+    """Return the peak resident set size in megabytes of this process or of its largest child, or None if unknown."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10
+
+
+def cpu_seconds():
+    """Return user and system time used by this process and its terminated child processes."""
+    if resource is None:
+        return time.process_time()
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def timed_call(func, *args):
+    """Return (func(*args), wall seconds, cpu seconds). Safe to run in a worker process."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+class Timings:
+    """Record wall time, cpu time and peak memory of stages, and the time spent on each notebook within a stage.
+
+    If profile names a stage, that stage is run under cProfile and the statistics are written to
+    nbpages_<stage>.prof for inspection with pstats or snakeviz.
+    """
+
+    def __init__(self, profile=None):
+        self.profile = profile
+        self.stages = []
+        self.notebooks = []
+        self.current = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager recording a stage."""
+        profiler = None
+        if name == self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        self.current = name
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(f"nbpages_{name}.prof")
+                log.info("- writing profile of %s to nbpages_%s.prof", name, name,
+                         extra={"action": "writing", "stage": name, "path": f"nbpages_{name}.prof"})
+            self.stages.append({"stage": name,
+                                "wall": time.perf_counter() - wall,
+                                "cpu": cpu_seconds() - cpu,
+                                "maxrss_mb": maxrss_mb(),
+                                "children_maxrss_mb": maxrss_mb(children=True)})
+            log.debug("- %s finished in %.3f s", name, self.stages[-1]["wall"],
+                      extra={"action": "finished", "stage": name, "duration": self.stages[-1]["wall"]})
+            self.current = None
+
+    @contextlib.contextmanager
+    def notebook(self, filename):
+        """Context manager recording the time spent on a notebook in the current stage."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.record(filename, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def record(self, filename, wall, cpu):
+        """Record the time spent on a notebook in the current stage."""
+        self.notebooks.append({"stage": self.current, "notebook": filename, "wall": wall, "cpu": cpu})
+        log.debug("- %s %s in %.3f s", self.current, filename, wall,
+                  extra={"action": "finished", "stage": self.current, "notebook": filename, "duration": wall})
+
+    def report(self):
+        """Return a dictionary of all stage and notebook timings."""
+        return {"stages": self.stages, "notebooks": self.notebooks}
+
+    def write_json(self, path):
+        """Write the timings report to a json file."""
+        log.info("- writing timings to %s", path, extra={"action": "writing", "path": path})
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+
+    def summary(self, slowest=3):
+        """Print a table of stage timings, listing the slowest notebooks in each stage."""
+        print(f"\n{'stage':<52}{'wall s':>10}{'cpu s':>10}{'rss MB':>10}")
+        for s in self.stages:
+            rss = "-" if s["maxrss_mb"] is None else f"{s['maxrss_mb']:.1f}"
+            print(f"{s['stage']:<52}{s['wall']:>10.3f}{s['cpu']:>10.3f}{rss:>10}")
+            notebooks = sorted((n for n in self.notebooks if n["stage"] == s["stage"]), key=lambda n: -n["wall"])
+            for n in notebooks[:slowest]:
+                print(f"    {n['notebook']:<48}{n['wall']:>10.3f}")
+        print(f"{'total':<52}{sum(s['wall'] for s in self.stages):>10.3f}{sum(s['cpu'] for s in self.stages):>10.3f}")
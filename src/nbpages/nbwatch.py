@@ -0,0 +1,207 @@
+import abc
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from . import nbcollection
+from .nbcollection import NB_FILENAME, DATA_SUFFIXES, FIGURE_EXCLUDE, asset_index
+
+log = logging.getLogger(__name__)
+
+# seconds between scans of the watched directories when inotify is not available
+POLL_INTERVAL = 1.0
+
+# seconds without further changes before a rebuild starts, so a burst of saves gives one rebuild
+SETTLE = 0.2
+
+# inotify events for files written, created, deleted or renamed in a watched directory
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Watcher(abc.ABC):
+    """Report paths of files changed in a set of directories."""
+
+    def __init__(self, dirs, interval=POLL_INTERVAL):
+        self.dirs = list(dict.fromkeys(os.path.abspath(d) for d in dirs if os.path.isdir(d)))
+        self.interval = interval
+
+    @abc.abstractmethod
+    def poll(self, timeout):
+        """Return the set of paths changed within timeout seconds."""
+
+    def changes(self, settle=SETTLE):
+        """Wait for changes, returning the set of changed paths once no change has been seen for settle seconds."""
+        paths = set()
+        while not paths:
+            paths = self.poll(self.interval)
+        while True:
+            more = self.poll(settle)
+            if not more:
+                return paths
+            paths |= more
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """Detect changes by comparing the modification times and sizes of files in each scan."""
+
+    def __init__(self, dirs, interval=POLL_INTERVAL):
+        super().__init__(dirs, interval)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for d in self.dirs:
+            with os.scandir(d) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        st = entry.stat()
+                        snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        snapshot = self.scan()
+        paths = {path for path in snapshot.keys() | self.snapshot.keys() if snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = snapshot
+        return paths
+
+
+class InotifyWatcher(Watcher):
+    """Receive changes from the Linux inotify interface, called through ctypes."""
+
+    def __init__(self, dirs, interval=POLL_INTERVAL):
+        import ctypes
+        super().__init__(dirs, interval)
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        for d in self.dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(d), INOTIFY_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {d}")
+            self.wds[wd] = d
+
+    def poll(self, timeout):
+        paths = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            buffer = os.read(self.fd, 65536)
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if wd in self.wds and name:
+                    paths.add(os.path.join(self.wds[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(dirs, interval=POLL_INTERVAL):
+    """Return an InotifyWatcher on Linux where inotify is available, otherwise a PollingWatcher."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dirs, interval)
+        except (AttributeError, OSError) as e:
+            log.debug("- inotify not available (%s), polling for changes every %s s", e, interval)
+    return PollingWatcher(dirs, interval)
+
+
+def classify(notebooks, paths):
+    """Sort changed paths into (changed notebooks, assets changed, reload needed).
+
+    A full reload is needed when notebooks, data or figure files are added or removed, or when the configuration
+    or templates change. Hidden files and editor backups are ignored.
+    """
+    config = nbcollection.config
+    src_dir = os.path.abspath(notebooks.src_dir)
+    data_dir = os.path.join(src_dir, config["data_subdir"])
+    figures_dir = os.path.join(src_dir, config["figures_subdir"])
+    by_path = {os.path.abspath(nb.path): nb for nb in notebooks.notebooks}
+    changed, assets, reload = [], False, False
+    for path in sorted(paths):
+        d, name = os.path.split(path)
+        if name.startswith(".") or name.endswith("~"):
+            continue
+        if d == os.path.abspath(config["templates_dir"]) or path == os.path.abspath("nbpages.cfg"):
+            reload = True
+        elif d == src_dir and NB_FILENAME.match(name):
+            if path in by_path and os.path.isfile(path):
+                changed.append(by_path[path])
+            else:
+                reload = True
+        elif d == data_dir and name.endswith(DATA_SUFFIXES) or d == figures_dir and not name.endswith(FIGURE_EXCLUDE):
+            index = asset_index(d, DATA_SUFFIXES) if d == data_dir else asset_index(d, None, FIGURE_EXCLUDE)
+            if name in index.names and os.path.isfile(path):
+                assets = True
+            else:
+                reload = True
+    return changed, assets, reload
+
+
+def watch(create, prepare=None, force=False, interval=POLL_INTERVAL):
+    """Publish a collection, then keep it in memory and republish the outputs affected by each change.
+
+    create is a function returning a new NbCollection, called again whenever a full reload is needed, with
+    force set for the first publish only. prepare is applied to each notebook after execution, if enabled,
+    and before numbering. Outputs of notebooks that did not change are left in place by way of the build manifest.
+    """
+    def publish(force=False):
+        notebooks = create(force=force)
+        notebooks.execute_notebooks()
+        if prepare:
+            for nb in notebooks.notebooks:
+                prepare(nb)
+        notebooks.publish()
+        return notebooks
+
+    notebooks = publish(force)
+    config = nbcollection.config
+    dirs = [notebooks.src_dir, os.path.join(notebooks.src_dir, config["data_subdir"]),
+            os.path.join(notebooks.src_dir, config["figures_subdir"]), config["templates_dir"], "."]
+    watcher = make_watcher(dirs, interval)
+    log.info("- watching %s for changes, press Ctrl-C to stop", ", ".join(watcher.dirs))
+    failed = False
+    try:
+        while True:
+            changed, assets, reload = classify(notebooks, watcher.changes())
+            if not (changed or assets or reload):
+                continue
+            start = time.perf_counter()
+            try:
+                if reload or failed:
+                    notebooks = publish()
+                else:
+                    log.info("- rebuilding for changes to %s",
+                             ", ".join([nb.filename for nb in changed] + (["data and figure files"] if assets else [])))
+                    notebooks.rebuild(changed, prepare=prepare, copy_assets=assets)
+            except Exception as e:
+                # a notebook may be saved in an unreadable state, leaving the collection partly rebuilt
+                log.error("- rebuild failed, the next change reloads all notebooks: %s", e)
+                failed = True
+                continue
+            failed = False
+            seconds = time.perf_counter() - start
+            log.info("- rebuilt in %.2f s", seconds, extra={"action": "rebuilt", "duration": seconds})
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
@@ -5,7 +5,7 @@
 {% if cell['metadata'].get('tags', []) %}
     <div style="background-color:white; border:thin solid grey; margin-left:95px; margin-right:6px">
     {% for tag in cell['metadata'].get('tags', []) %}
-        &nbsp; <a href="https://{github_user_name}.github.io/{github_repo_name}/tag_index.html#{{ tag }}">{{ tag }}</a>
+        &nbsp; <a href="https://{{ github_user_name }}.github.io/{{ github_repo_name }}/tag_index.html#{{ tag }}">{{ tag }}</a>
     {% endfor %}
     </div>
     {% if 'home-activity' in cell['metadata'].get('tags', []) %}
@@ -0,0 +1,15 @@
+import pytest
+
+from benchmarks.corpus import make_corpus
+
+
+@pytest.fixture
+def corpus(request, tmp_path, monkeypatch):
+    """Return a synthetic notebook repository in tmp_path, made the current directory.
+
+    The keyword arguments of make_corpus are given by indirect parametrization, for example
+    @pytest.mark.parametrize("corpus", [dict(notebooks=3)], indirect=True).
+    """
+    make_corpus(str(tmp_path), **getattr(request, "param", {}))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
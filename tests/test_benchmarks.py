@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.run import run_stages
+from nbpages.nbcollection import PUBLISH_STAGES
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=3, cells=6, sections=2, output_kb=1)], indirect=True)
+def test_benchmark_stages(corpus):
+    """Run every publish stage on a small synthetic repository"""
+    results = run_stages()
+    assert [r["stage"] for r in results] == ["create"] + list(PUBLISH_STAGES)
+    assert (corpus / "docs" / "02.00-Chapter-2.html").exists()
@@ -33,3 +33,38 @@ def test_remove_cells():
 
 def test_remove_code():
     assert 0 == os.system('nbpages --remove_code')
+
+def test_publish_force():
+    assert 0 == os.system('nbpages --publish --force')
+
+def test_publish_jobs():
+    assert 0 == os.system('nbpages --publish --force --jobs 4')
+
+def test_cache():
+    assert 0 == os.system('nbpages --lint --cache')
+    assert 0 == os.system('nbpages --tags --cache')
+
+def test_search_options():
+    assert 0 == os.system('nbpages --search lint --count')
+    assert 0 == os.system('nbpages --search lint --json --search_outputs --jobs 2')
+
+def test_timings():
+    assert 0 == os.system('nbpages --publish --timings')
+
+def test_logging():
+    assert 0 == os.system('nbpages --publish --quiet')
+    assert 0 == os.system('nbpages --publish -v --log_json -')
+
+def test_get_cells_many(tmp_path):
+    assert 0 == os.system(f'nbpages --get_cells exercise home-activity --cells_dir {tmp_path}')
+    assert sorted(os.listdir(tmp_path)) == ["exercise.ipynb", "home-activity.ipynb"]
+
+def test_query_tags():
+    assert 0 == os.system('nbpages --query_tags "author::FRB AND NOT exercise"')
+    assert 0 == os.system('nbpages --query-tags author --count --json')
+    assert 0 != os.system('nbpages --query_tags "author AND"')
+
+def test_find():
+    assert 0 == os.system('nbpages --find "thiele modulus"')
+    assert 0 == os.system('nbpages --find "tag*" --json')
+    assert 0 == os.system('nbpages --publish --search_json')
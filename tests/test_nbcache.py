@@ -0,0 +1,30 @@
+import pytest
+
+import os
+
+from nbpages.nbcache import ParseCache
+
+
+def test_parse_cache(tmp_path):
+    """Entries are keyed by file mtime and size"""
+    path = tmp_path / "a.ipynb"
+    path.write_text("{}")
+    cache = ParseCache(str(tmp_path / "cache"))
+    assert cache.get(str(path), "content") is None
+    cache.put(str(path), "content", {"cells": []})
+    assert cache.get(str(path), "content") == {"cells": []}
+    path.write_text("{ }")
+    assert cache.get(str(path), "content") is None
+
+
+def test_parse_cache_eviction(tmp_path):
+    """Least recently used entries are removed when the cache is full"""
+    cache = ParseCache(str(tmp_path / "cache"), max_bytes=4000)
+    paths = [tmp_path / f"{k}.ipynb" for k in range(4)]
+    for k, path in enumerate(paths):
+        path.write_text("{}")
+        cache.put(str(path), "content", "x" * 1500)
+        os.utime(cache.entry(str(path), "content"), (k, k))
+    assert cache.size <= 4000
+    assert cache.get(str(paths[0]), "content") is None
+    assert cache.get(str(paths[-1]), "content") == "x" * 1500
@@ -1,10 +1,301 @@
 import pytest
+import json
+import os
+import subprocess
+import sys
+import warnings
+
+import nbformat
 
 from nbpages import NbCollection
+from nbpages.nbcache import ParseCache
+from nbpages.nbcollection import SEARCH_INDEX_FILE, AssetIndex, TagIndex, cell_imports, read_metadata
 
 def test_nbcollection_import():
     pass
 
 def test_nbcollection_constructor():
     """Read notebooks from src directory"""
-    notebooks = NbCollection()
\ No newline at end of file
+    notebooks = NbCollection()
+
+def test_nb_facts_invalidated():
+    """Facts are cached until the cells are changed"""
+    notebooks = NbCollection()
+    nb = notebooks.notebooks[1]
+    title = nb.title
+    assert nb.facts is nb.facts
+    nb.insert_subsection_numbers()
+    assert nb.title.endswith(title) and nb.title != title
+
+
+def test_asset_index():
+    """File names are matched as literals, including names that are prefixes of other names"""
+    index = AssetIndex(["a.png", "aa.png", "data(1).csv"])
+    assert index.findall("![](figures/aa.png) data(1).csv") == {"a.png", "aa.png", "data(1).csv"}
+    assert index.findall("aXpng") == set()
+
+
+def test_lazy_loading():
+    """Notebooks are read on first access, and metadata can be read without the cells"""
+    notebooks = NbCollection()
+    nb = notebooks.notebooks[0]
+    assert nb._content is None
+    with open(nb.path) as f:
+        assert nb.metadata == read_metadata(nb.path, chunk_size=16) == json.load(f)["metadata"]
+    assert nb._content is None
+    assert nb.content.cells
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 13, 64, 65536])
+def test_read_metadata_chunks(tmp_path, chunk_size):
+    """The metadata is found across chunk boundaries, and files too long to search are parsed in full"""
+    metadata = {"kernelspec": {"display_name": "Python 3", "name": "python3"}, "title": "x" * 100}
+    nb = nbformat.v4.new_notebook(metadata=metadata, cells=[nbformat.v4.new_code_cell("1 + 1")])
+    path = str(tmp_path / "nb.ipynb")
+    nbformat.write(nb, path)
+    assert read_metadata(path, chunk_size=chunk_size) == metadata
+    assert read_metadata(path, chunk_size=chunk_size, max_chunks=1) == metadata
+
+
+def test_extract_cells():
+    """Cells for several tags are extracted in one pass, and removed in one pass"""
+    notebooks = NbCollection()
+    tags = ["exercise", "home-activity", "no-such-tag"]
+    extracted = notebooks.extract_cells(tags)
+    assert list(extracted) == tags
+    assert all(extracted[tag] == notebooks.get_cells(tag) for tag in tags)
+    count = sum(len(nb.get_cells("exercise")) for nb in notebooks.notebooks)
+    assert count and len(json.loads(extracted["exercise"])["cells"]) == count
+    notebooks.remove_cells(*tags)
+    assert not any(nb.get_cells(tag) for nb in notebooks.notebooks for tag in tags)
+
+
+def test_tag_index_queries():
+    """Hierarchical terms match tags by prefix, and combine with AND, OR and NOT"""
+    index = TagIndex({"author::FRB::": ["a"], "author::EWT::": ["b"], "author::FRB::Chapter-1": ["c"],
+                      "concept::Thiele-Modulus": ["c"], "exercise": ["d", "a"]})
+    assert index.query("author") == ["a", "b", "c"]
+    assert index.query("author::FRB") == ["a", "c"]
+    assert index.query("author::E*") == ["b"]
+    assert index.query("author AND NOT exercise") == ["b", "c"]
+    assert index.query("(author::EWT or exercise) NOT concept") == ["a", "b", "d"]
+    assert index.counts("author::FRB OR exercise") == {"author::FRB::": 1, "author::FRB::Chapter-1": 1, "exercise": 2}
+    assert index.counts("author AND NOT exercise") == index.counts("author")
+    assert "exercise" in index.counts("author AND NOT (NOT exercise)")
+    with pytest.raises(ValueError):
+        index.query("author AND")
+
+
+def test_tag_tree_cached():
+    """With a warm cache, tag queries are answered without reading the notebooks"""
+    links = NbCollection(cache=True).query_tags("author::FRB")
+    notebooks = NbCollection(cache=True)
+    assert notebooks.query_tags("author::FRB") == links and len(links) == 2
+    assert all(nb._content is None for nb in notebooks.notebooks)
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=4, cells=4, sections=2)], indirect=True)
+def test_search_index_incremental(corpus):
+    """The search index re-reads only notebooks that changed, and is not evicted from the parse cache"""
+    notebooks = NbCollection()
+    path = notebooks.notebooks[2].path
+    content = nbformat.read(path, as_version=4)
+    content.cells.append(nbformat.v4.new_markdown_cell("## Thiele modulus"))
+    nbformat.write(content, path)
+    index = notebooks.search_index()
+    assert index.search("thiele")[0]["notebook"] == notebooks.notebooks[2].filename
+    files = dict(index.files)
+    nb = notebooks.notebooks[0]
+    os.utime(nb.path, ns=(0, 0))
+    ParseCache(max_bytes=0).evict()
+    assert os.path.exists(SEARCH_INDEX_FILE)
+    index = notebooks.search_index()
+    assert [f for f in files if files[f] != index.files[f]] == [nb.filename]
+
+
+def test_cell_imports():
+    """Imports are found with ast, including multi-line and from imports, with IPython magics ignored"""
+    source = "%matplotlib inline\nimport numpy as np, os.path\nfrom matplotlib import (\n    pyplot,\n    cm)\nfiles = !ls"
+    assert cell_imports(source) == ("numpy", "os.path", "matplotlib.pyplot", "matplotlib.cm")
+    assert cell_imports("%%bash\nimport x") == ()
+    assert cell_imports("import y\ndef f(:\n    from z import w") == ("y", "z.w")
+    assert cell_imports("np.sum??\n?np.mean\nimport numpy as np") == ("numpy",)
+    assert cell_imports("import os  # needed?\nx = f(a)  # why?") == ("os",)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        assert cell_imports('import re\nre.compile("\\d+")') == ("re",)
+    assert not caught
+
+
+def test_python_index():
+    """The python index includes from imports and is computed once"""
+    notebooks = NbCollection()
+    assert "scipy.integrate.solve_ivp" in notebooks.python_index
+    assert notebooks.python_index is notebooks.python_index
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=3, cells=4, sections=1, output_kb=1)], indirect=True)
+def test_extract_images(corpus):
+    """Output images are written once to content addressed files, linked from the html and removed when unused"""
+    paths = sorted((corpus / "notebooks").glob("*.ipynb"))
+    first, second = (nbformat.read(str(path), as_version=4) for path in paths[:2])
+    second.cells.append(next(cell for cell in first.cells if cell.cell_type == "code"))
+    nbformat.write(second, str(paths[1]))
+    notebooks = NbCollection(extract_images=True)
+    notebooks.publish()
+    images_dir = corpus / "docs" / "figures" / "_outputs"
+    images = sorted(os.listdir(images_dir))
+    assert len(images) == len(set(notebooks.images[paths[0].name]) | set(notebooks.images[paths[1].name])
+                              | set(notebooks.images[paths[2].name]))
+    html = (corpus / "docs" / paths[0].with_suffix(".html").name).read_text()
+    assert 'src="data:image/png' not in html and f'src="figures/_outputs/{notebooks.images[paths[0].name][0]}"' in html
+    notebooks = NbCollection(extract_images=True)
+    notebooks.publish()
+    assert notebooks.written == []
+    NbCollection().publish()
+    assert os.listdir(images_dir) == []
+    assert 'src="data:image/png' in (corpus / "docs" / paths[0].with_suffix(".html").name).read_text()
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=2, cells=6, sections=1, data=2)], indirect=True)
+def test_compress(corpus):
+    """Published files get compressed siblings, which are removed when their files are removed or changed"""
+    notebooks = NbCollection(compress=True)
+    notebooks.publish()
+    assert (corpus / "docs" / "toc.html.gz").is_file()
+    assert (corpus / "docs" / "01.00-Chapter-1.ipynb.gz").is_file()
+    data = [corpus / "docs" / (path + ".gz") for nb in notebooks.notebooks for path, url in nb.data_import_links]
+    assert data and all(path.is_file() for path in data)
+    snapshot = {path: path.stat().st_mtime_ns for path in (corpus / "docs").rglob("*")}
+    notebooks = NbCollection(compress=True)
+    notebooks.publish()
+    assert notebooks.written == []
+    assert {path: path.stat().st_mtime_ns for path in (corpus / "docs").rglob("*")} == snapshot
+    (corpus / "notebooks" / "01.00-Chapter-1.ipynb").unlink()
+    NbCollection().publish()
+    assert not (corpus / "docs" / "01.00-Chapter-1.ipynb.gz").exists()
+    assert not (corpus / "docs" / "toc.html.gz").exists()
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("corpus", [dict(notebooks=2, cells=4, sections=1)], indirect=True)
+def test_compress_keeps_other_files(corpus, compress):
+    """Compressed files not written by nbpages are left in place"""
+    (corpus / "docs" / "downloads").mkdir()
+    others = [corpus / "docs" / "downloads" / "course-materials.tar.gz", corpus / "docs" / "dataset.csv.gz",
+              corpus / "docs" / "fonts.woff2.br"]
+    for path in others:
+        path.write_bytes(b"not written by nbpages")
+    NbCollection(compress=compress).publish()
+    NbCollection().publish()
+    assert all(path.read_bytes() == b"not written by nbpages" for path in others)
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=2, cells=6, sections=1, data=2)], indirect=True)
+def test_execution_cache(corpus, monkeypatch):
+    """Notebooks are executed again only when their code or data files change, and failures keep the outputs"""
+    notebooks = NbCollection(execute=True, cache=True)
+    nb = next(nb for nb in notebooks.notebooks if nb.data_import_links)
+    key = notebooks.execution_key(nb)
+    nb.content.cells.append(nbformat.v4.new_markdown_cell("more text"))
+    assert notebooks.execution_key(nb) == key
+    (corpus / "notebooks" / nb.data_import_links[0][0]).write_text("x,y\n1,2\n")
+    assert notebooks.execution_key(nb) != key
+    key = notebooks.execution_key(nb)
+
+    outputs = [cell.outputs for cell in nb.content.cells if cell.cell_type == "code"]
+    nb.content.metadata["kernelspec"] = {"name": "no-such-kernel"}
+    notebooks.execute_notebooks([nb])
+    assert [cell.outputs for cell in nb.content.cells if cell.cell_type == "code"] == outputs
+
+    results = [([nbformat.v4.new_output("stream", name="stdout", text="cached\n")], 1) for output in outputs]
+    notebooks.cache.put_key(f"execute|{notebooks.execution_key(nb)}", results)
+    monkeypatch.setattr("nbpages.nbcollection.execute_notebook", None)
+    notebooks.execute_notebooks([nb])
+    assert all(cell.outputs[0].text == "cached\n" for cell in nb.content.cells if cell.cell_type == "code")
+    assert nb.modified
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=1, cells=1, sections=1, data=0)], indirect=True)
+def test_execute(corpus):
+    """Notebooks are executed in the notebooks directory"""
+    pytest.importorskip("ipykernel")
+    notebooks = NbCollection(execute=True, timeout=60)
+    nb = notebooks.notebooks[0]
+    nb.content.cells = [nbformat.v4.new_code_cell("import os\nprint(os.path.basename(os.getcwd()))")]
+    notebooks.execute_notebooks()
+    assert nb.content.cells[0].outputs[0].text == "notebooks\n"
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=4, cells=6, sections=2)], indirect=True)
+def test_publish_variants(corpus):
+    """Variants published from one load equal separate publishes with the same removals"""
+    path = sorted((corpus / "notebooks").glob("*.ipynb"))[1]
+    content = nbformat.read(str(path), as_version=4)
+    content.cells.insert(1, nbformat.v4.new_markdown_cell("## Solution", metadata={"tags": ["instructor"]}))
+    content.cells.append(nbformat.v4.new_code_cell("### BEGIN SOLUTION\nx = 1\n### END SOLUTION"))
+    nbformat.write(content, str(path))
+    with open("nbpages.cfg", "a") as f:
+        f.write("\n[variant:student]\ndst_dir = student\nremove_cells = instructor\nremove_code = yes\n"
+                "\n[variant:instructor]\ndst_dir = instructor\n\n[variant:draft]\ndst_dir = draft\n")
+    for name in ["student", "instructor", "expected_student", "expected_instructor"]:
+        (corpus / name).mkdir()
+    with pytest.raises(AssertionError, match="draft"):
+        NbCollection().publish_variants(["draft"])
+    NbCollection().publish_variants(["student", "instructor"])
+    notebooks = NbCollection(dst_dir="expected_student")
+    notebooks.remove_cells("instructor")
+    notebooks.remove_code()
+    notebooks.publish()
+    NbCollection(dst_dir="expected_instructor").publish()
+
+    def snapshot(name):
+        return {f.name: f.read_bytes().replace(b"expected_", b"") for f in (corpus / name).iterdir()
+                if f.is_file() and not f.name.startswith(".")}
+
+    assert snapshot("student") == snapshot("expected_student")
+    assert snapshot("instructor") == snapshot("expected_instructor")
+    assert snapshot("student") != snapshot("instructor")
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=7, cells=6, sections=3, output_kb=1)], indirect=True)
+def test_sharded_publish(corpus):
+    """Shards published by separate processes and merged give the same site as a single publish"""
+    (corpus / "expected").mkdir()
+    options = ["--search_json", "--extract_images", "--remove_cells", "tag-00"]
+    shards = [subprocess.Popen([sys.executable, "-m", "nbpages", "--shard", f"{k}/3"] + options) for k in [1, 2, 3]]
+    assert [process.wait() for process in shards] == [0, 0, 0]
+    assert len(list((corpus / "docs").glob(".nbpages_shard_*"))) == 3
+    assert subprocess.call([sys.executable, "-m", "nbpages", "--merge"] + options) == 0
+    notebooks = NbCollection(dst_dir="expected", search_json=True, extract_images=True)
+    notebooks.remove_cells("tag-00")
+    notebooks.publish()
+
+    def snapshot(name):
+        files = {}
+        for root, dirs, names in os.walk(corpus / name):
+            for f in names:
+                with open(os.path.join(root, f), 'rb') as g:
+                    files[os.path.relpath(os.path.join(root, f), corpus / name)] = g.read().replace(b"expected/", b"docs/")
+        return files
+
+    merged, expected = snapshot("docs"), snapshot("expected")
+    assert not any(f.startswith(".nbpages_shard") for f in merged)
+    assert json.loads(merged.pop(".nbpages_manifest.json"))["images"] == \
+        json.loads(expected.pop(".nbpages_manifest.json"))["images"]
+    assert merged == expected
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=6, cells=4, sections=1)], indirect=True)
+def test_shard_reads_neighbours(corpus):
+    """A shard reads its notebooks, their neighbours, and other notebooks only to find a tagged cell"""
+    paths = sorted((corpus / "notebooks").glob("*.ipynb"))
+    for path in paths[:-1]:
+        content = nbformat.read(str(path), as_version=4)
+        for cell in content.cells:
+            cell.metadata.pop("tags", None)
+        nbformat.write(content, str(path))
+    notebooks = NbCollection()
+    notebooks.publish_shard(1, 6)
+    assert [nb._facts is not None for nb in notebooks.notebooks] == [True, True, False, False, False, True]
+    assert "tag_index.html" in (corpus / "docs" / paths[0].with_suffix(".html").name).read_text()
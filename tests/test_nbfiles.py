@@ -0,0 +1,65 @@
+import gzip
+import os
+
+import pytest
+
+from nbpages.nbfiles import compress_files, sync_files, write_if_changed
+
+
+def test_write_if_changed(tmp_path):
+    """Files are only replaced when their content changes, keeping their permissions"""
+    path = str(tmp_path / "page.html")
+    assert write_if_changed(path, "<p>ü</p>")
+    os.chmod(path, 0o640)
+    mtime = os.stat(path).st_mtime_ns
+    assert not write_if_changed(path, "<p>ü</p>".encode("utf-8"))
+    assert os.stat(path).st_mtime_ns == mtime
+    assert write_if_changed(path, "<p>u</p>")
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert (tmp_path / "page.html").read_text() == "<p>u</p>"
+    assert os.listdir(tmp_path) == ["page.html"]
+
+
+def test_write_if_changed_umask(tmp_path):
+    """New files get the permissions allowed by the umask, which is left unchanged by concurrent writes"""
+    import concurrent.futures
+    umask = os.umask(0o027)
+    try:
+        paths = [str(tmp_path / f"page{k}.html") for k in range(64)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            assert all(executor.map(write_if_changed, paths, ["<p>page</p>"] * len(paths)))
+        assert os.umask(0o027) == 0o027
+    finally:
+        os.umask(umask)
+    assert {os.stat(path).st_mode & 0o777 for path in paths} == {0o640}
+
+
+def test_sync_files(tmp_path):
+    """Only new and changed files are copied, and only files no longer used are removed"""
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    (dst / "_outputs").mkdir(parents=True)
+    for name in ["a.png", "b.png", "c.png"]:
+        (src / name).write_bytes(name.encode() * 100)
+    (dst / "old.png").write_text("old")
+    assert sync_files(str(src), str(dst), ["a.png", "b.png"]) == (["a.png", "b.png"], [], ["old.png"])
+    assert sync_files(str(src), str(dst), ["a.png", "b.png"]) == ([], ["a.png", "b.png"], [])
+    (src / "a.png").write_bytes(b"changed")
+    os.utime(dst / "b.png", ns=(0, 0))
+    assert sync_files(str(src), str(dst), ["a.png", "b.png", "c.png"]) == (["a.png", "c.png"], ["b.png"], [])
+    assert (dst / "a.png").read_bytes() == b"changed"
+    assert sorted(os.listdir(dst)) == ["_outputs", "a.png", "b.png", "c.png"]
+
+
+def test_compress_files(tmp_path):
+    """Compressed siblings are written only when missing or older than their file"""
+    page = tmp_path / "page.html"
+    path = str(page)
+    write_if_changed(path, "<p>page</p>" * 100)
+    [(sibling, written, saved)] = [r for r in compress_files([path]) if r[0].endswith(".gz")]
+    assert sibling == path + ".gz" and written and saved > 0
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == page.read_bytes()
+    assert not any(written for sibling, written, saved in compress_files([path]))
+    write_if_changed(path, "<p>changed</p>")
+    assert all(written for sibling, written, saved in compress_files([path]))
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == b"<p>changed</p>"
@@ -0,0 +1,24 @@
+import json
+import logging
+
+import pytest
+
+from nbpages.nblogging import setup_logging
+
+
+def test_log_json(tmp_path, capsys):
+    """Events are written as json lines with their attributes, and the console respects the verbosity"""
+    path = tmp_path / "log.json"
+    setup_logging(verbosity=-1, json_path=str(path))
+    log = logging.getLogger("nbpages.nbcollection")
+    log.info("- writing %s", "docs/toc.html", extra={"action": "writing", "path": "docs/toc.html"})
+    log.debug("- docs/index.html is up to date")
+    for handler in logging.getLogger("nbpages").handlers:
+        handler.flush()
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [e["level"] for e in events] == ["info", "debug"]
+    assert events[0]["message"] == "- writing docs/toc.html"
+    assert events[0]["action"] == "writing"
+    assert "action" not in events[1]
+    assert capsys.readouterr().err == ""
+    setup_logging()
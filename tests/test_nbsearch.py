@@ -0,0 +1,63 @@
+import pytest
+
+import json
+
+from nbpages.nbsearch import SearchIndex, iter_cells, search_file
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    path = tmp_path / "01.01-Test.ipynb"
+    cells = [{"cell_type": "markdown", "metadata": {}, "source": ["# Title\n", "some text"]},
+             {"cell_type": "code", "metadata": {}, "execution_count": 1, "source": "print('text')",
+              "outputs": [{"output_type": "stream", "name": "stdout", "text": ["text\n"]}]}]
+    path.write_text(json.dumps({"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 4}))
+    return str(path)
+
+
+def test_search_file(notebook):
+    assert search_file(notebook, "text") == [{"cell": 0, "line": 2, "context": "some text"}]
+    assert len(search_file(notebook, "text", first=False)) == 2
+    assert len(search_file(notebook, "text", outputs=True, first=False)) == 3
+    assert search_file(notebook, "missing") == []
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64, 2**16])
+def test_iter_cells(notebook, chunk_size):
+    """Cells are parsed one at a time across chunk boundaries, and other layouts are parsed in full"""
+    with open(notebook) as f:
+        cells = json.load(f)["cells"]
+    with open(notebook) as f:
+        assert list(iter_cells(f, chunk_size=chunk_size)) == cells
+    with open(notebook, "w") as f:
+        json.dump({"nbformat": 3, "worksheets": [{"cells": cells}]}, f)
+    with open(notebook) as f:
+        assert list(iter_cells(f, chunk_size=chunk_size)) == cells
+
+
+def test_search_file_stops_at_match(notebook):
+    """The first match is found without reading the rest of the file"""
+    with open(notebook) as f:
+        text = f.read()
+    with open(notebook, "w") as f:
+        f.write(text[:text.index('{"cell_type": "code"')] + "not json")
+    assert search_file(notebook, "some")[0]["cell"] == 0
+
+
+def test_search_index(tmp_path):
+    """Sections are ranked by relevance, and notebooks can be replaced or removed"""
+    index = SearchIndex("config")
+    index.add("a.ipynb", (1, 1), [("[1.1 Reactors](a.html#1.1)", "reactor design and reactor kinetics"),
+                                  ("[1.2 Heat](a.html#1.2)", "heat transfer in a reactor jacket")])
+    index.add("b.ipynb", (1, 1), [("[2.1 Mass](b.html#2.1)", "mass transfer")])
+    assert [r["link"] for r in index.search("reactor")] == ["[1.1 Reactors](a.html#1.1)", "[1.2 Heat](a.html#1.2)"]
+    assert [r["notebook"] for r in index.search("trans*")] == ["b.ipynb", "a.ipynb"]
+    index.add("a.ipynb", (2, 1), [("[1.1 Reactors](a.html#1.1)", "batch reactor")])
+    index.remove("b.ipynb")
+    assert index.search("transfer") == []
+    assert sorted(index.postings) == ["batch", "reactor"] and index.total == 2
+    path = str(tmp_path / "index.pickle")
+    index.save(path)
+    assert SearchIndex.load(path, "config").files == index.files
+    assert SearchIndex.load(path, "other").files == {}
+    assert json.loads(index.to_json())["docs"] == [["1.1 Reactors", "a.html#1.1", 2]]
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from nbpages.nbtemplates import html_exporter, jinja_environment, render_template
+
+
+def test_legacy_placeholders(tmp_path):
+    """Placeholders of earlier templates render as template variables, and environments are reused"""
+    (tmp_path / "page.tpl").write_text("https://{github_user_name}.github.io/{{ github_repo_name }}/{{ tag }}")
+    assert render_template(str(tmp_path), "page.tpl", github_user_name="user", github_repo_name="repo",
+                           tag="x") == "https://user.github.io/repo/x"
+    assert jinja_environment(str(tmp_path)) is jinja_environment(str(tmp_path))
+
+
+def test_bytecode_cache(tmp_path):
+    """Compiled templates are written to the bytecode cache directory"""
+    (tmp_path / "page.tpl").write_text("{{ page_title }}")
+    bytecode_dir = str(tmp_path / "jinja")
+    assert render_template(str(tmp_path), "page.tpl", bytecode_dir, page_title="title") == "title"
+    assert os.listdir(bytecode_dir)
+
+
+def test_html_exporter(tmp_path):
+    """Exporters are reused until the template file changes"""
+    template = tmp_path / "notebook.tpl"
+    template.write_text("{% extends 'full.tpl'%}")
+    exporter = html_exporter(str(template))
+    assert html_exporter(str(template)) is exporter
+    template.write_text("{% extends 'full.tpl'%}\n")
+    assert html_exporter(str(template)) is not exporter
+    assert html_exporter() is html_exporter()
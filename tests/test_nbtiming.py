@@ -0,0 +1,27 @@
+import pytest
+
+from nbpages.nbtiming import Timings
+
+
+def test_timings(tmp_path):
+    """Stages and notebooks within stages are recorded"""
+    timings = Timings()
+    with timings.stage("write_html"):
+        with timings.notebook("01.00-Test.ipynb"):
+            pass
+    report = timings.report()
+    assert [s["stage"] for s in report["stages"]] == ["write_html"]
+    assert report["notebooks"][0]["stage"] == "write_html"
+    timings.write_json(str(tmp_path / "timings.json"))
+    timings.summary()
+
+
+def test_timings_without_resource(monkeypatch, capsys):
+    """Timings are recorded where the resource module is missing, with unknown memory"""
+    monkeypatch.setattr("nbpages.nbtiming.resource", None)
+    timings = Timings()
+    with timings.stage("load"):
+        pass
+    assert timings.stages[0]["maxrss_mb"] is None and timings.stages[0]["cpu"] >= 0
+    timings.summary()
+    assert "load" in capsys.readouterr().out
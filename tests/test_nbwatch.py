@@ -0,0 +1,71 @@
+import os
+
+import nbformat
+import pytest
+
+from nbpages import NbCollection
+from nbpages.nbwatch import PollingWatcher, classify, make_watcher
+
+
+def snapshot(path):
+    """Return the contents of all files in a directory tree."""
+    files = {}
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(root, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(root, name), path)] = f.read()
+    return files
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=5, cells=6, sections=2)], indirect=True)
+def test_rebuild(corpus):
+    """Rebuilding after a change to one notebook gives the same outputs as a full publish"""
+    notebooks = NbCollection()
+    notebooks.publish()
+    nb = notebooks.notebooks[2]
+    content = nbformat.read(nb.path, as_version=4)
+    content.cells[0].source = "# Renamed Chapter"
+    content.cells[1].metadata["tags"] = ["new-tag"]
+    nbformat.write(content, nb.path)
+    changed, assets, reload = classify(notebooks, {os.path.abspath(nb.path)})
+    assert changed == [nb] and not assets and not reload
+    notebooks.rebuild(changed)
+    assert "Renamed Chapter" in (corpus / "docs" / "02.01-Section-2-1.html").read_text()
+    rebuilt = snapshot(corpus / "docs")
+    notebooks = NbCollection(force=True)
+    notebooks.publish()
+    assert notebooks.written == []
+    assert snapshot(corpus / "docs") == rebuilt
+
+
+@pytest.mark.parametrize("corpus", [dict(notebooks=2, cells=4)], indirect=True)
+def test_classify(corpus):
+    """New notebooks and changes to templates need a full reload, and hidden files are ignored"""
+    notebooks = NbCollection()
+    assert classify(notebooks, {str(corpus / "notebooks" / ".~01.00-Chapter-1.ipynb")}) == ([], False, False)
+    assert classify(notebooks, {str(corpus / "notebooks" / "03.00-New.ipynb")}) == ([], False, True)
+    assert classify(notebooks, {str(corpus / "templates" / "notebook.tpl")}) == ([], False, True)
+    assert classify(notebooks, {str(corpus / "notebooks" / "data" / "data_0000.csv")}) == ([], True, False)
+
+
+@pytest.mark.parametrize("watcher_class", [PollingWatcher, make_watcher])
+def test_watcher(tmp_path, watcher_class):
+    """Changed, new and deleted files are reported"""
+    (tmp_path / "a.ipynb").write_text("a")
+    (tmp_path / "b.ipynb").write_text("b")
+    watcher = watcher_class([str(tmp_path)], interval=0.05)
+    (tmp_path / "a.ipynb").write_text("changed")
+    (tmp_path / "b.ipynb").unlink()
+    (tmp_path / "c.ipynb").write_text("c")
+    paths = watcher.changes(settle=0.05)
+    watcher.close()
+    assert paths == {str(tmp_path / name) for name in ["a.ipynb", "b.ipynb", "c.ipynb"]}
+
+
+def test_make_watcher_polls_elsewhere(tmp_path, monkeypatch):
+    """Platforms other than Linux poll for changes without trying inotify"""
+    monkeypatch.setattr("sys.platform", "win32")
+    monkeypatch.setattr("nbpages.nbwatch.InotifyWatcher", None)
+    watcher = make_watcher([str(tmp_path)])
+    assert isinstance(watcher, PollingWatcher)
+    watcher.close()
@@ -0,0 +1,51 @@
+import pytest
+
+import subprocess
+import sys
+import time
+
+# modules that must not be imported by commands which do not render notebooks
+HEAVY_MODULES = ["nbconvert", "nbformat", "jinja2"]
+
+# seconds allowed for startup beyond that of a bare python interpreter
+STARTUP_LIMIT = 1.0
+
+
+def imported_modules(*argv):
+    """Run nbpages in a fresh interpreter and return the heavy modules imported."""
+    code = f"""
+import sys
+sys.argv = {['nbpages', *argv]!r}
+import nbpages.__main__
+try:
+    nbpages.__main__.main()
+except SystemExit:
+    pass
+print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return result.stdout.splitlines()[-1].split()
+
+
+def startup_time(*argv):
+    """Return the best of three wall clock times to run a command."""
+    times = []
+    for k in range(3):
+        start = time.perf_counter()
+        subprocess.run(argv, capture_output=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_help_imports():
+    assert imported_modules("--help") == []
+
+
+def test_search_imports():
+    assert imported_modules("--search", "lint") == []
+
+
+def test_startup_time():
+    baseline = startup_time(sys.executable, "-c", "pass")
+    assert startup_time(sys.executable, "-m", "nbpages", "--help") - baseline < STARTUP_LIMIT
+    assert startup_time(sys.executable, "-m", "nbpages", "--search", "lint") - baseline < STARTUP_LIMIT